@@ -0,0 +1,157 @@
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, String, Text, Integer, DateTime, LargeBinary, select, update, insert
+
+# Tables owned by the agent loop itself. They live on their own MetaData
+# (not database.models) so they can be created on an existing database
+# without touching the lead/conversation schema.
+metadata = MetaData()
+
+# Named sync cursors, e.g. the last Gmail history ID seen for a label
+sync_cursors = Table(
+    "sync_cursors",
+    metadata,
+    Column("name", String(64), primary_key=True),
+    Column("value", String(255), nullable=False),
+    Column("updated_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+# Names of schema migrations already applied (see migrations.py)
+schema_migrations = Table(
+    "schema_migrations",
+    metadata,
+    Column("name", String(128), primary_key=True),
+    Column("applied_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+# Rolling summary of the older messages of a conversation context
+# (context_key is "thread:<thread_id>" or "lead:<lead_id>")
+thread_summaries = Table(
+    "thread_summaries",
+    metadata,
+    Column("context_key", String(255), primary_key=True),
+    Column("summary", Text, nullable=False),
+    Column("summarized_count", Integer, nullable=False),
+    Column("updated_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+# LLM completions keyed on a hash of model, settings and normalized prompt
+# (see generation_cache.py); last_used_at drives LRU eviction
+generation_cache = Table(
+    "generation_cache",
+    metadata,
+    Column("key", String(64), primary_key=True),
+    Column("response", Text, nullable=False),
+    Column("created_at", DateTime, nullable=False, default=datetime.utcnow),
+    Column("last_used_at", DateTime, nullable=False, default=datetime.utcnow, index=True),
+)
+
+# Durable outbox of replies and follow-ups (see outbox.py). Each row moves
+# received -> generated -> sending -> sent -> recorded (or failed); the key is
+# the idempotency key, so an email is never queued or sent twice.
+outbox = Table(
+    "outbox",
+    metadata,
+    Column("key", String(255), primary_key=True),
+    Column("kind", String(16), nullable=False),
+    Column("state", String(16), nullable=False, index=True),
+    Column("lead_id", Integer, nullable=False),
+    Column("thread_id", String(255), nullable=False),
+    Column("source_msg_id", String(255)),
+    Column("parent_message_id", String(255)),
+    Column("sender", String(255)),
+    Column("recipient", String(255), nullable=False),
+    Column("subject", Text),
+    Column("reply_text", Text),
+    Column("cache_key", String(64)),
+    Column("sent_message_id", String(255)),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("last_error", Text),
+    Column("claimed_by", String(128)),
+    Column("claimed_at", DateTime),
+    Column("created_at", DateTime, nullable=False, default=datetime.utcnow),
+    Column("updated_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+# Leases that partition work between agent workers sharing one database
+# (see leases.py); resource is e.g. "lead:<email>"
+leases = Table(
+    "leases",
+    metadata,
+    Column("resource", String(255), primary_key=True),
+    Column("owner", String(128), nullable=False),
+    Column("expires_at", DateTime, nullable=False, index=True),
+    Column("heartbeat_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+# When each lead is next due a follow-up (see follow_up_schedule.py), computed
+# once when our last message to the lead is recorded; message_id is that message
+follow_up_schedule = Table(
+    "follow_up_schedule",
+    metadata,
+    Column("lead_id", Integer, primary_key=True),
+    Column("message_id", String(255)),
+    Column("next_follow_up_at", DateTime, nullable=False, index=True),
+    Column("updated_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+# Conversation bodies, compressed and kept out of the conversations table so
+# queries on conversation metadata stay small (see body_store.py)
+conversation_bodies = Table(
+    "conversation_bodies",
+    metadata,
+    Column("message_id", String(255), primary_key=True),
+    Column("codec", String(8), nullable=False),
+    Column("body", LargeBinary, nullable=False),
+    Column("size", Integer, nullable=False),
+)
+
+
+def init_agent_state(session):
+    """Create the agent-owned tables if they do not exist yet."""
+    metadata.create_all(bind=session.get_bind())
+
+
+def get_cursor(session, name):
+    return session.execute(
+        select(sync_cursors.c.value).where(sync_cursors.c.name == name)
+    ).scalar()
+
+
+def get_cursor_updated_at(session, name):
+    return session.execute(
+        select(sync_cursors.c.updated_at).where(sync_cursors.c.name == name)
+    ).scalar()
+
+
+def set_cursor(session, name, value):
+    now = datetime.utcnow()
+    result = session.execute(
+        update(sync_cursors)
+        .where(sync_cursors.c.name == name)
+        .values(value=str(value), updated_at=now)
+    )
+    if result.rowcount == 0:
+        session.execute(
+            insert(sync_cursors).values(name=name, value=str(value), updated_at=now)
+        )
+    session.commit()
+
+
+def get_thread_summary(session, context_key):
+    """Return (summary, summarized_count) or None."""
+    row = session.execute(
+        select(thread_summaries.c.summary, thread_summaries.c.summarized_count)
+        .where(thread_summaries.c.context_key == context_key)
+    ).first()
+    return tuple(row) if row else None
+
+
+def save_thread_summary(session, context_key, summary, summarized_count):
+    now = datetime.utcnow()
+    values = {'summary': summary, 'summarized_count': summarized_count, 'updated_at': now}
+    result = session.execute(
+        update(thread_summaries).where(thread_summaries.c.context_key == context_key).values(**values)
+    )
+    if result.rowcount == 0:
+        session.execute(insert(thread_summaries).values(context_key=context_key, **values))
+    session.commit()
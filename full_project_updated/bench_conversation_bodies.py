@@ -0,0 +1,129 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker, defer
+from database.models import Conversation, Lead
+from agent_state import metadata, conversation_bodies
+from body_store import body_rows, load_bodies
+from follow_up_schedule import awaiting_follow_up
+from migrations import MIGRATIONS
+
+AGENT_EMAIL = "agent@buildyoursocials.com"
+WORDS = ("thanks for getting back to me we would love to hear more about your pricing and whether the "
+         "package includes content creation for instagram tiktok and linkedin our team is small so "
+         "timing matters please let me know what the next steps are best regards").split()
+
+
+def synthetic_bodies(count, rng):
+    # Replies as the agent stores them: a few HTML paragraphs over a quoted earlier message
+    bodies = []
+    for _ in range(count):
+        paragraphs = ["<p>" + " ".join(rng.choices(WORDS, k=rng.randint(20, 80))) + "</p>" for _ in range(rng.randint(2, 6))]
+        quoted = "<blockquote>" + " ".join(rng.choices(WORDS, k=rng.randint(50, 300))) + "</blockquote>"
+        bodies.append("<html><body>" + "".join(paragraphs) + quoted + "</body></html>")
+    return bodies
+
+
+def build_db(path, rows, per_lead, split, bodies, rng):
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}")
+    Lead.metadata.create_all(engine)
+    metadata.create_all(engine)
+    compressed = body_rows(enumerate(bodies))
+    leads = rows // per_lead
+    start = datetime.utcnow() - timedelta(days=30)
+    with engine.begin() as conn:
+        conn.execute(insert(Lead.__table__), [
+            {'id': i, 'email': f"lead{i}@example.com", 'status': 'Initial'} for i in range(1, leads + 1)
+        ])
+        for first in range(0, rows, 10_000):
+            batch, stored = [], []
+            for n in range(first, min(first + 10_000, rows)):
+                lead_id = n // per_lead + 1
+                choice = rng.randrange(len(bodies))
+                message_id = f"<m{n}@example.com>"
+                batch.append({
+                    'lead_id': lead_id, 'thread_id': f"thread{lead_id}", 'message_id': message_id,
+                    'sender': AGENT_EMAIL if n % 2 else f"lead{lead_id}@example.com",
+                    'recipient': f"lead{lead_id}@example.com" if n % 2 else AGENT_EMAIL,
+                    'subject': "Your enquiry", 'body': '' if split else bodies[choice],
+                    'timestamp': start + timedelta(seconds=n), 'last_message_owner': 'agent' if n % 2 else 'lead',
+                })
+                if split:
+                    stored.append(dict(compressed[choice], message_id=message_id))
+            conn.execute(insert(Conversation.__table__), batch)
+            if stored:
+                conn.execute(insert(conversation_bodies), stored)
+        # The indexes the agent database has after migrations 0001 and 0003
+        for name, migrate in MIGRATIONS:
+            if name.startswith(("0001", "0003")):
+                migrate(conn)
+    return engine
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def measure(label, engine, path, split, args):
+    session = sessionmaker(bind=engine)()
+    leads = args.rows // args.per_lead
+    scan_leads = max(1, leads // 10)
+
+    def metadata_scan():
+        # Conversation rows without their bodies, e.g. thread state or follow-up bookkeeping
+        query = session.query(Conversation).filter(Conversation.lead_id <= scan_leads)
+        if split:
+            query = query.options(defer(Conversation.body))
+        return len(query.all())
+
+    def histories():
+        # Prompt history of a few hundred threads: the only place bodies are read
+        chars = 0
+        for lead_id in random.Random(7).sample(range(1, leads + 1), min(args.threads, leads)):
+            query = session.query(Conversation).filter(Conversation.thread_id == f"thread{lead_id}")
+            if split:
+                convs = query.options(defer(Conversation.body)).all()
+                chars += sum(len(body) for body in load_bodies(session, convs).values())
+            else:
+                chars += sum(len(conv.body) for conv in query.all())
+        return chars
+
+    scanned, scan_time = timed(metadata_scan)
+    session.expunge_all()
+    awaiting, follow_up_time = timed(lambda: len(awaiting_follow_up(session)))
+    session.expunge_all()
+    chars, history_time = timed(histories)
+    session.close()
+    print(f"{label:<7} size={os.path.getsize(path) / 2 ** 20:8.1f}MiB "
+          f"scan({scanned} rows)={scan_time:6.2f}s follow-up({awaiting} leads)={follow_up_time:6.2f}s "
+          f"history({args.threads} threads, {chars} chars)={history_time:5.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversation storage: bodies inline vs compressed in conversation_bodies")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="conversation rows")
+    parser.add_argument("--per-lead", type=int, default=10, help="conversation rows per lead (one thread each)")
+    parser.add_argument("--threads", type=int, default=200, help="threads whose prompt history is loaded")
+    parser.add_argument("--distinct-bodies", type=int, default=5000)
+    parser.add_argument("--dir", default=tempfile.gettempdir())
+    args = parser.parse_args()
+
+    bodies = synthetic_bodies(args.distinct_bodies, random.Random(42))
+    for label, split in (("inline", False), ("split", True)):
+        path = os.path.join(args.dir, f"bench_bodies_{label}.db")
+        engine = build_db(path, args.rows, args.per_lead, split, bodies, random.Random(42))
+        measure(label, engine, path, split, args)
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
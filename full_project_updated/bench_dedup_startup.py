@@ -0,0 +1,67 @@
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+from database.models import Conversation, Lead
+from message_dedup import ProcessedMessageIndex
+
+
+def build_db(path, rows):
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}")
+    Lead.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Lead.__table__).values(id=1, email="lead@example.com", status="Initial"))
+        for start in range(0, rows, 100000):
+            conn.execute(insert(Conversation.__table__), [
+                {'lead_id': 1, 'thread_id': f"t{n // 10}", 'message_id': f"<m{n}@example.com>",
+                 'sender': "lead@example.com", 'body': ""}
+                for n in range(start, min(rows, start + 100000))
+            ])
+        conn.execute(text(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS uq_conversations_message_id ON {Conversation.__tablename__} (message_id)"
+        ))
+
+
+def measure(path, mode, rows):
+    # Runs in a fresh interpreter so ru_maxrss reflects only this mode
+    session = sessionmaker(bind=create_engine(f"sqlite:///{path}"))()
+    probe = [f"<m{n}@example.com>" for n in range(0, rows, max(1, rows // 100))]
+    start = time.perf_counter()
+    if mode == "legacy":
+        known = set(msg_id for (msg_id,) in session.query(Conversation.message_id).all())
+        startup = time.perf_counter() - start
+        hits = sum(1 for message_id in probe if message_id in known)
+    else:
+        known = ProcessedMessageIndex(session)
+        startup = time.perf_counter() - start
+        hits = len(known.stored(probe))
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"rows={rows:<10} mode={mode:<7} startup={startup:.3f}s peak_rss={rss_mb:.0f}MB hits={hits}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time and RSS of the processed-message check")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "bench_dedup.db"))
+    parser.add_argument("--measure", nargs=2, metavar=("MODE", "ROWS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.db, args.measure[0], int(args.measure[1]))
+        return
+
+    for rows in args.rows:
+        build_db(args.db, rows)
+        for mode in ("legacy", "index"):
+            subprocess.run([sys.executable, __file__, "--db", args.db, "--measure", mode, str(rows)], check=True)
+
+
+if __name__ == "__main__":
+    main()
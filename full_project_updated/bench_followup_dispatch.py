@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+from database.models import Conversation, Lead
+from agent_state import metadata
+from fake_gmail import FakeGmailClient
+from follow_up_dispatch import FollowUpDispatcher, recipient_domain
+from follow_up_schedule import FollowUpScheduler, get_leads_needing_followup
+from leases import LeaseManager
+from llm_client import AsyncLLMClient
+from mock_llm_server import MockLLMServer
+from outbox import Outbox, follow_up_key, FOLLOW_UP
+
+AGENT_EMAIL = "agent@buildyoursocials.com"
+
+
+class MockLLMGeneration:
+    """GenerationCache stand-in that calls the mock LLM server on every follow-up."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def generate(self, prompt, settings):
+        return None, await self.client.generate_reply(prompt)
+
+    def discard(self, key):
+        pass
+
+
+class NoHistory:
+    def for_thread(self, thread_id):
+        return []
+
+
+class FixedTemplates:
+    def render(self, name, **values):
+        return "Write a short, friendly follow-up."
+
+
+class TimedGmail(FakeGmailClient):
+    """Fake Gmail that remembers when each follow-up was sent, per recipient domain."""
+
+    def __init__(self, latency):
+        super().__init__(address=AGENT_EMAIL, latency=latency)
+        self.send_times = defaultdict(list)
+
+    def send_message(self, message):
+        self.send_times[recipient_domain(message['to'])].append(time.monotonic())
+        return super().send_message(message)
+
+
+def build_db(leads, rng):
+    engine = create_engine("sqlite://")
+    Lead.metadata.create_all(engine)
+    metadata.create_all(engine)
+    sent_at = datetime.utcnow() - timedelta(hours=1)
+    # Half the cohort on one big provider, the rest spread over a few others and company domains
+    domains = ["gmail.com"] * 10 + ["outlook.com"] * 4 + ["yahoo.com"] * 2 + [f"company{i}.com" for i in range(4)]
+    with engine.begin() as conn:
+        conn.execute(insert(Lead.__table__), [
+            {'id': i, 'email': f"lead{i}@{rng.choice(domains)}", 'status': 'Initial'} for i in range(1, leads + 1)
+        ])
+        conn.execute(insert(Conversation.__table__), [
+            {'lead_id': i, 'thread_id': f"thread{i}", 'message_id': f"<m{i}@example.com>", 'sender': AGENT_EMAIL,
+             'subject': "Your enquiry", 'body': "Thanks for reaching out!", 'timestamp': sent_at,
+             'last_message_owner': 'agent'}
+            for i in range(1, leads + 1)
+        ])
+    return sessionmaker(bind=engine)()
+
+
+async def sequential(session, outbox, leases, follow_ups, due_leads, args):
+    # The previous loop: one lead at a time, each generated, sent and committed before the next
+    for item in get_leads_needing_followup(session, lead_ids=due_leads):
+        lead, last_conv = item['lead'], item['last_conversation']
+        key = follow_up_key(last_conv.message_id)
+        if outbox.enqueue(key, FOLLOW_UP, lead.id, last_conv.thread_id, lead.email,
+                          parent_message_id=last_conv.message_id, sender=last_conv.sender, subject=last_conv.subject):
+            await outbox.deliver(key)
+
+
+async def dispatched(session, outbox, leases, follow_ups, due_leads, args):
+    dispatcher = FollowUpDispatcher(session, outbox, leases, follow_ups, concurrency=args.concurrency,
+                                    sends_per_second=args.sends_per_second, domain_interval=args.domain_interval,
+                                    window=args.window)
+    # Like main's loop: each pass sends what the pacing allows, then waits for the rest to come due
+    passes = []
+    while due_leads:
+        start = time.perf_counter()
+        await dispatcher.dispatch(due_leads)
+        passes.append(time.perf_counter() - start)
+        wait = follow_ups.seconds_until_next()
+        if wait is None or wait > args.window * 2:
+            break
+        await asyncio.sleep(wait)
+        due_leads = follow_ups.due(limit=args.leads)
+    print(f"dispatch passes={len(passes)} longest={max(passes):.1f}s")
+
+
+async def run(label, strategy, server, args):
+    session = build_db(args.leads, random.Random(42))
+    commits = [0]
+    event.listen(session, "after_commit", lambda s: commits.__setitem__(0, commits[0] + 1))
+
+    gmail = TimedGmail(latency=args.gmail_latency)
+    llm = AsyncLLMClient(base_url=server.base_url, api_key="test", default_model="mock", concurrency=args.concurrency)
+    follow_ups = FollowUpScheduler(session)
+    follow_ups.seed()
+    leases = LeaseManager(session, owner="bench")
+    outbox = Outbox(session, gmail, NoHistory(), FixedTemplates(), MockLLMGeneration(llm), None,
+                    leases=leases, gmail_concurrency=4, follow_ups=follow_ups)
+    due_leads = follow_ups.due(limit=args.leads)
+    commits[0] = 0
+
+    start = time.perf_counter()
+    await strategy(session, outbox, leases, follow_ups, due_leads, args)
+    elapsed = time.perf_counter() - start
+    await llm.aclose()
+
+    # Most sends to a single domain within any one-second window
+    worst_burst = max(
+        (sum(1 for t in times if first <= t < first + 1) for times in gmail.send_times.values() for first in times),
+        default=0,
+    )
+    print(f"{label:<12} sent={len(gmail.sent):<5} wall={elapsed:6.1f}s rate={len(gmail.sent) / elapsed:5.1f}/s "
+          f"commits={commits[0]:<6} max_same_domain_per_second={worst_burst}")
+
+
+async def bench(args):
+    async with MockLLMServer(latency=args.llm_latency) as server:
+        if not args.skip_sequential:
+            await run("sequential", sequential, server, args)
+        await run("dispatcher", dispatched, server, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Follow-up throughput: sequential loop vs dispatcher, fake LLM and Gmail")
+    parser.add_argument("--leads", type=int, default=200)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per mock completion")
+    parser.add_argument("--gmail-latency", type=float, default=0.05, help="seconds per fake Gmail round trip")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--sends-per-second", type=float, default=20)
+    parser.add_argument("--domain-interval", type=float, default=0.2)
+    parser.add_argument("--window", type=float, default=2, help="seconds of paced sends per dispatch pass")
+    parser.add_argument("--skip-sequential", action="store_true")
+    asyncio.run(bench(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
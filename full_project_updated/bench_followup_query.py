@@ -0,0 +1,138 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from database.models import Conversation, Lead
+from agent_state import metadata
+from follow_up_schedule import FollowUpScheduler, get_leads_needing_followup
+from migrations import MIGRATIONS
+
+AGENT_EMAIL = "agent@buildyoursocials.com"
+
+
+def build_db(engine, leads, conversations):
+    Lead.metadata.create_all(engine)
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    per_lead = max(1, conversations // leads)
+    body = "Thanks for reaching out! " * 40
+
+    with engine.begin() as conn:
+        conn.execute(insert(Lead.__table__), [
+            {'id': i, 'email': f"lead{i}@example.com", 'status': rng.choice(['Initial', 'Progress', 'Closed'])}
+            for i in range(1, leads + 1)
+        ])
+
+        rows = []
+        message_no = 0
+        for lead_id in range(1, leads + 1):
+            thread_id = f"thread{lead_id}"
+            start = now - timedelta(hours=rng.randint(1, 24 * 30))
+            for n in range(per_lead):
+                message_no += 1
+                from_agent = n % 2 == 1 if rng.random() < 0.7 else n % 2 == 0
+                rows.append({
+                    'lead_id': lead_id,
+                    'thread_id': thread_id,
+                    'message_id': f"<m{message_no}@example.com>",
+                    'sender': AGENT_EMAIL if from_agent else f"lead{lead_id}@example.com",
+                    'recipient': f"lead{lead_id}@example.com" if from_agent else AGENT_EMAIL,
+                    'subject': "Your enquiry",
+                    'body': body,
+                    'timestamp': start + timedelta(minutes=10 * n),
+                    'last_message_owner': 'agent' if from_agent else 'lead',
+                })
+                if len(rows) >= 50000:
+                    conn.execute(insert(Conversation.__table__), rows)
+                    rows = []
+        if rows:
+            conn.execute(insert(Conversation.__table__), rows)
+        # The conversation indexes of a migrated database; the scheduler's per-batch queries rely on them
+        dict(MIGRATIONS)["0001_conversation_hot_path_indexes"](conn)
+
+
+def legacy_get_leads_needing_followup(session):
+    # The previous 1 + 2N implementation, kept for comparison
+    cutoff_time = datetime.utcnow() - timedelta(minutes=2)
+    active_leads = session.query(Lead).filter(Lead.status.in_(['Initial', 'Progress'])).all()
+    leads_to_followup = []
+    for lead in active_leads:
+        conversations = session.query(Conversation).filter_by(
+            lead_id=lead.id
+        ).order_by(Conversation.timestamp.desc()).all()
+        if not conversations:
+            continue
+        latest_conversation = conversations[0]
+        if (latest_conversation.last_message_owner == 'agent' and
+                latest_conversation.timestamp < cutoff_time):
+            thread_messages = session.query(Conversation).filter_by(
+                thread_id=latest_conversation.thread_id
+            ).order_by(Conversation.timestamp.desc()).all()
+            if thread_messages and thread_messages[0].sender != lead.email:
+                leads_to_followup.append({
+                    'lead': lead,
+                    'last_conversation': latest_conversation,
+                    'thread_messages': thread_messages
+                })
+    return leads_to_followup
+
+
+def timed(label, fn, session):
+    session.expire_all()
+    start = time.perf_counter()
+    result = fn(session)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} eligible={len(result):<8} wall={elapsed:.2f}s")
+    return result
+
+
+def drain(session, scheduler):
+    # due() hands out at most FOLLOW_UP_BATCH_SIZE leads per cycle, so run cycles until nothing is due,
+    # postponing each batch the way the dispatcher does once its follow-ups are queued
+    handled = []
+    while True:
+        lead_ids = scheduler.due()
+        if not lead_ids:
+            return handled
+        handled.extend(get_leads_needing_followup(session, lead_ids=lead_ids))
+        scheduler.postpone(lead_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Follow-up candidate selection on a synthetic SQLite database")
+    parser.add_argument("--leads", type=int, default=100_000)
+    parser.add_argument("--conversations", type=int, default=1_000_000)
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "bench_followup.db"))
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    engine = create_engine(f"sqlite:///{args.db}")
+    start = time.perf_counter()
+    build_db(engine, args.leads, args.conversations)
+    print(f"Built {args.leads} leads / {args.conversations} conversations in {time.perf_counter() - start:.1f}s")
+
+    session = sessionmaker(bind=engine)()
+    new = timed("set-based", get_leads_needing_followup, session)
+    if not args.skip_legacy:
+        old = timed("legacy", legacy_get_leads_needing_followup, session)
+        assert {item['lead'].id for item in old} == {item['lead'].id for item in new}
+
+    # Scheduler: one full pass at startup, then each cycle only looks at the due leads
+    metadata.create_all(engine)
+    scheduler = FollowUpScheduler(session)
+    start = time.perf_counter()
+    scheduler.seed()
+    print(f"{'seed':<10} wall={time.perf_counter() - start:.2f}s")
+    scheduled = timed("due cycles", lambda s: drain(s, scheduler), session)
+    assert {item['lead'].id for item in scheduled} == {item['lead'].id for item in new}
+    timed("idle cycle", lambda s: scheduler.due(), session)
+
+
+if __name__ == "__main__":
+    main()
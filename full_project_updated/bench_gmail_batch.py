@@ -0,0 +1,45 @@
+import argparse
+import time
+from fake_gmail import FakeGmailClient
+from gmail_batch import get_messages_batch, ENVELOPE_HEADERS
+
+
+def seed(client, count):
+    for i in range(count):
+        client.add_message(
+            sender=f"lead{i}@example.com",
+            to=client.address,
+            subject=f"Question {i}",
+            body="Hi, I would like to know more about your services. " * 20,
+            cc="partner@example.com" if i % 3 == 0 else None,
+        )
+    return list(client.messages)
+
+
+def run(label, client, fetch):
+    client.round_trips = 0
+    start = time.perf_counter()
+    fetched = fetch()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} messages={fetched:<6} round_trips={client.round_trips:<6} wall={elapsed:.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-message vs batched Gmail fetch against the in-memory Gmail stub")
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated seconds per HTTP round trip")
+    args = parser.parse_args()
+
+    client = FakeGmailClient(latency=args.latency)
+    ids = seed(client, args.messages)
+
+    run("per-message get_full_message", client,
+        lambda: sum(1 for msg_id in ids if client.get_full_message(msg_id)))
+    run("batch format=full", client,
+        lambda: len(get_messages_batch(client, ids)))
+    run("batch format=metadata", client,
+        lambda: len(get_messages_batch(client, ids, format='metadata', metadata_headers=ENVELOPE_HEADERS)))
+
+
+if __name__ == "__main__":
+    main()
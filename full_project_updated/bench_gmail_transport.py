@@ -0,0 +1,51 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fake_gmail import FakeGmailClient, FakeGmailHttp
+from gmail_transport import HttpPool, RetryingHttp, TokenBucket
+
+MESSAGE_URI = "https://gmail.googleapis.com/gmail/v1/users/me/messages/{}?format=full&alt=json"
+
+
+def seed(client, count):
+    for i in range(count):
+        client.add_message(
+            sender=f"lead{i}@example.com",
+            to=client.address,
+            subject=f"Question {i}",
+            body="Hi, I would like to know more about your services.",
+        )
+    return list(client.messages)
+
+
+def run(label, http, ids, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        statuses = list(pool.map(lambda msg_id: http.request(MESSAGE_URI.format(msg_id))[0].status, ids))
+    elapsed = time.perf_counter() - start
+    fetched = sum(1 for status in statuses if status == 200)
+    print(f"{label:<10} fetched={fetched}/{len(ids)} wall={elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gmail fetches through the retrying transport against a fake injecting 429s")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.2, help="share of requests answered with 429")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--quota", type=float, default=1000, help="quota units per second for the token bucket")
+    args = parser.parse_args()
+
+    client = FakeGmailClient()
+    ids = seed(client, args.messages)
+
+    plain = FakeGmailHttp(client, error_rate=args.error_rate, seed=1)
+    run("plain", plain, ids, args.threads)
+
+    fake = FakeGmailHttp(client, error_rate=args.error_rate, seed=1)
+    transport = RetryingHttp(HttpPool(lambda: fake, size=args.threads), bucket=TokenBucket(rate=args.quota))
+    run("retrying", transport, ids, args.threads)
+    print(f"injected 429s={fake.throttled}  transport: {transport.metrics.summary()}")
+
+
+if __name__ == "__main__":
+    main()
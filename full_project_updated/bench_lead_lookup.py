@@ -0,0 +1,70 @@
+import argparse
+import random
+import time
+from sqlalchemy import create_engine, event, insert, text
+from sqlalchemy.orm import sessionmaker
+from database.db_handler import get_lead_by_email
+from database.models import Lead
+from lead_store import LeadDirectory, leads
+
+
+def build_session(count):
+    engine = create_engine("sqlite://")
+    leads.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(leads), [
+            {'id': i, 'email': f"lead{i}@example.com", 'email_canonical': f"lead{i}@example.com", 'status': 'Initial'}
+            for i in range(1, count + 1)
+        ])
+        conn.execute(text(f"CREATE INDEX ix_leads_email_lookup ON {Lead.__tablename__} (email)"))
+        conn.execute(text(
+            f"CREATE UNIQUE INDEX uq_leads_email_canonical ON {Lead.__tablename__} (email_canonical)"
+        ))
+    statements = [0]
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.__setitem__(0, statements[0] + 1))
+    return sessionmaker(bind=engine)(), statements
+
+
+def senders(count, lookups, rng):
+    # A few leads write most of the mail, and mail clients vary the From header
+    weights = [1 / rank for rank in range(1, count + 1)]
+    ids = rng.choices(range(1, count + 1), weights=weights, k=lookups)
+    styles = ["lead{}@example.com", "Lead{}@Example.com", '"Lead {}" <lead{}@example.com>']
+    return [rng.choice(styles).format(i, i) for i in ids]
+
+
+def lookup_all(session, lookup, headers):
+    # The agent loop commits after every stored message, which expires whatever the session holds
+    found = 0
+    for header in headers:
+        lead = lookup(header)
+        # Callers use the lead's id (outbox entry, conversation row)
+        if lead is not None and lead.id:
+            found += 1
+        session.commit()
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lead lookup from raw From headers: by email vs canonical + LRU cache")
+    parser.add_argument("--leads", type=int, default=50_000)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    args = parser.parse_args()
+
+    headers = senders(args.leads, args.lookups, random.Random(42))
+
+    session, statements = build_session(args.leads)
+    start = time.perf_counter()
+    found = lookup_all(session, lambda header: get_lead_by_email(session, header), headers)
+    print(f"{'by raw email':<14} found={found:<6} queries={statements[0]:<6} wall={time.perf_counter() - start:.2f}s")
+
+    session, statements = build_session(args.leads)
+    directory = LeadDirectory(session)
+    start = time.perf_counter()
+    found = lookup_all(session, directory.get, headers)
+    print(f"{'canonical+LRU':<14} found={found:<6} queries={statements[0]:<6} wall={time.perf_counter() - start:.2f}s "
+          f"hits={directory.hits} misses={directory.misses}")
+
+
+if __name__ == "__main__":
+    main()
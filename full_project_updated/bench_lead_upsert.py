@@ -0,0 +1,62 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from sqlalchemy import create_engine, text, func, select
+from sqlalchemy.orm import sessionmaker
+from database.db_handler import get_lead_by_email, add_lead
+from database.models import Lead
+from lead_store import bulk_upsert_leads, leads
+
+
+def fresh_session(path):
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}")
+    # The leads table as migrated: email_canonical column, unique email indexes
+    leads.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_leads_email ON {Lead.__tablename__} (email)"))
+        conn.execute(text(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS uq_leads_email_canonical ON {Lead.__tablename__} (email_canonical)"
+        ))
+    return sessionmaker(bind=engine)()
+
+
+def sent_cc_lists(messages, distinct, rng):
+    # A backfill over the Sent folder: the same partners show up on many messages
+    return [[f"partner{rng.randrange(distinct)}@example.com" for _ in range(rng.randint(1, 3))] for _ in range(messages)]
+
+
+def per_address(session, cc_lists):
+    # The previous harvester: one lookup and, for new addresses, one insert + commit each
+    for cc_addresses in cc_lists:
+        for cc in cc_addresses:
+            if not get_lead_by_email(session, cc):
+                add_lead(session, cc)
+
+
+def batched(session, cc_lists):
+    bulk_upsert_leads(session, {cc for cc_addresses in cc_lists for cc in cc_addresses})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CC-lead harvesting: per-address inserts vs bulk_upsert_leads on SQLite")
+    parser.add_argument("--messages", type=int, default=5000, help="sent messages in the backfill")
+    parser.add_argument("--distinct", type=int, default=3000, help="distinct CC addresses")
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "bench_leads.db"))
+    args = parser.parse_args()
+
+    cc_lists = sent_cc_lists(args.messages, args.distinct, random.Random(42))
+    for label, harvest in (("per-address", per_address), ("bulk upsert", batched)):
+        session = fresh_session(args.db)
+        start = time.perf_counter()
+        harvest(session, cc_lists)
+        elapsed = time.perf_counter() - start
+        stored = session.execute(select(func.count()).select_from(Lead)).scalar()
+        print(f"{label:<12} leads={stored:<6} wall={elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
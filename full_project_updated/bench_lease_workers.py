@@ -0,0 +1,180 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import timedelta
+from sqlalchemy import create_engine, insert, select, func
+from sqlalchemy.orm import sessionmaker
+from database.models import Lead
+from agent_state import metadata, outbox as outbox_table
+import outbox as outbox_module
+from outbox import Outbox, reply_key, REPLY, RECORDED
+from leases import LeaseManager, lead_resource
+
+AGENT_EMAIL = "agent@buildyoursocials.com"
+
+
+class SharedGmail:
+    """Just enough of GmailClient for the outbox, with every send logged to a SQLite table all workers see."""
+
+    def __init__(self, path, crash_after_send=False):
+        self.path = path
+        self.crash_after_send = crash_after_send
+        self.service = self
+
+    def create_message(self, to, subject, message_text, thread_id=None, in_reply_to=None, references=None):
+        return {'to': to, 'threadId': thread_id, 'in_reply_to': in_reply_to}
+
+    def send_message(self, message):
+        with sqlite3.connect(self.path, timeout=30) as conn:
+            conn.execute("INSERT INTO sent_log (thread_id, recipient, message_id, sent_ms) VALUES (?, ?, ?, ?)",
+                         (message['threadId'], message['to'], message['message_id'], int(time.time() * 1000)))
+            row_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        if self.crash_after_send:
+            # Die between Gmail accepting the message and the outbox recording it
+            os._exit(1)
+        return {'id': f"sent{row_id}", 'threadId': message['threadId']}
+
+    def mark_as_read(self, msg_id):
+        pass
+
+    # service.users().messages().list(q='rfc822msgid:...').execute() for the outbox's crash check
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def list(self, userId, q):
+        self._message_id = q.split("rfc822msgid:", 1)[1]
+        return self
+
+    def execute(self):
+        with sqlite3.connect(self.path, timeout=30) as conn:
+            rows = conn.execute("SELECT id, thread_id FROM sent_log WHERE message_id = ?", (self._message_id,)).fetchall()
+        return {'messages': [{'id': f"sent{row_id}", 'threadId': thread_id} for row_id, thread_id in rows]}
+
+
+class CannedGeneration:
+    async def generate(self, prompt, settings):
+        await asyncio.sleep(random.uniform(0.005, 0.02))
+        return None, "Thanks for reaching out!"
+
+    def discard(self, key):
+        pass
+
+
+class NoHistory:
+    def for_lead(self, lead_id):
+        return []
+
+    def for_thread(self, thread_id):
+        return []
+
+
+class FixedTemplates:
+    def render(self, name, **values):
+        return "You are a helpful sales assistant."
+
+
+async def work(path, worker_no, messages, crash, lease_ttl, deadline):
+    engine = create_engine(f"sqlite:///{path}", connect_args={'timeout': 30})
+    session = sessionmaker(bind=engine)()
+    owner = f"worker{worker_no}"
+    leases = LeaseManager(session, owner=owner, ttl=lease_ttl)
+    box = Outbox(session, SharedGmail(path, crash_after_send=crash), NoHistory(), FixedTemplates(),
+                 CannedGeneration(), None, leases=leases, worker_id=owner)
+    lead_ids = dict(session.execute(select(Lead.email, Lead.id)).all())
+
+    while time.time() < deadline:
+        # Every worker sees the whole (shared) inbox, like N copies polling one mailbox
+        batch = random.sample(messages, min(len(messages), 20))
+        held = leases.acquire_many({lead_resource(email) for _, email in batch})
+        try:
+            for message_id, email in batch:
+                if lead_resource(email) not in held:
+                    continue
+                key = reply_key(message_id)
+                box.enqueue(key, REPLY, lead_ids[email], f"thread-{message_id}", email,
+                            parent_message_id=message_id, sender=AGENT_EMAIL, subject="Hello")
+                await box.deliver(key)
+        finally:
+            leases.release(held)
+        await box.recover()
+
+        done = session.execute(
+            select(func.count()).select_from(outbox_table).where(outbox_table.c.state == RECORDED)
+        ).scalar()
+        if done == len(messages):
+            break
+
+
+def run_worker(path, worker_no, messages, crash, lease_ttl, claim_timeout, deadline):
+    random.seed(worker_no)
+    outbox_module.SEND_CLAIM_TIMEOUT = claim_timeout
+    asyncio.run(work(path, worker_no, messages, crash, lease_ttl, deadline))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="N agent workers sharing one SQLite database must never reply twice")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--leads", type=int, default=30)
+    parser.add_argument("--messages", type=int, default=120)
+    parser.add_argument("--lease-ttl", type=int, default=2)
+    parser.add_argument("--timeout", type=int, default=60)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "workers.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Lead.metadata.create_all(engine)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Lead.__table__), [
+            {'id': i, 'email': f"lead{i}@example.com", 'status': 'Initial'} for i in range(1, args.leads + 1)
+        ])
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE sent_log (id INTEGER PRIMARY KEY, thread_id TEXT, recipient TEXT, message_id TEXT, sent_ms INTEGER)"
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+
+    messages = [(f"<m{i}@example.com>", f"lead{i % args.leads + 1}@example.com") for i in range(args.messages)]
+    deadline = time.time() + args.timeout
+    claim_timeout = timedelta(seconds=args.lease_ttl)
+
+    start = time.perf_counter()
+    # Worker 0 crashes right after its first send, before the outbox records it
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(
+            path, n, messages, n == 0, args.lease_ttl, claim_timeout, deadline))
+        for n in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    with sqlite3.connect(path) as conn:
+        sends = conn.execute("SELECT COUNT(*) FROM sent_log").fetchone()[0]
+        duplicates = conn.execute(
+            "SELECT COUNT(*) FROM (SELECT thread_id FROM sent_log GROUP BY thread_id HAVING COUNT(*) > 1)"
+        ).fetchone()[0]
+        recorded = conn.execute("SELECT COUNT(*) FROM outbox WHERE state = 'recorded'").fetchone()[0]
+        per_worker = conn.execute(
+            "SELECT claimed_by, COUNT(*) FROM outbox GROUP BY claimed_by ORDER BY claimed_by"
+        ).fetchall()
+
+    print(f"workers={args.workers} messages={args.messages} wall={elapsed:.1f}s exit_codes={[p.exitcode for p in processes]}")
+    print(f"sent={sends} recorded={recorded} threads_replied_twice={duplicates}")
+    print(f"sends per worker: {dict(per_worker)}")
+    assert duplicates == 0, "a message was replied to twice"
+    assert recorded == args.messages, "not every message was delivered"
+
+
+if __name__ == "__main__":
+    main()
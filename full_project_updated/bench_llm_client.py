@@ -0,0 +1,36 @@
+import argparse
+import asyncio
+import time
+from llm_client import AsyncLLMClient
+from mock_llm_server import MockLLMServer
+
+
+async def run(args):
+    async with MockLLMServer(latency=args.latency, error_rate=args.error_rate, seed=1) as server:
+        client = AsyncLLMClient(base_url=server.base_url, api_key="test", default_model="mock", concurrency=args.concurrency)
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(client.generate_reply(f"Prompt {i}", timeout=args.latency * 10 + 5) for i in range(args.requests)),
+            return_exceptions=True,
+        )
+        elapsed = time.perf_counter() - start
+        await client.aclose()
+
+    failed = sum(1 for result in results if isinstance(result, Exception))
+    print(f"generations={args.requests} failed={failed} concurrency={args.concurrency} wall={elapsed:.2f}s")
+    print(f"server: requests={server.requests} injected_errors={server.errors_injected} "
+          f"peak_in_flight={server.peak_in_flight} connections={server.connections}")
+    print(f"client: retries={client.retries}  sequential estimate={args.requests * args.latency:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent generations against the local mock LLM server")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated seconds per completion")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="share of requests answered with 429")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
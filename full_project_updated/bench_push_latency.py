@@ -0,0 +1,92 @@
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from agent_state import metadata
+from fake_gmail import FakeGmailClient
+from fake_pubsub import FakePublisher
+from mailbox_sync import MailboxSync
+from push_listener import PushListener
+
+
+async def deliver_mail(client, publisher, count, mean_gap, arrivals):
+    """Drop count messages into the inbox at random intervals, announcing each one if publisher is set."""
+    rng = random.Random(7)
+    for i in range(count):
+        await asyncio.sleep(rng.expovariate(1 / mean_gap))
+        msg_id = client.add_message(f"lead{i}@example.com", client.address, f"Question {i}", "Can you tell me more?")
+        arrivals[msg_id] = time.monotonic()
+        if publisher is not None:
+            await publisher.publish(client.address, client.history_id)
+
+
+async def agent_loop(client, sync, listener, interval, count, arrivals, latencies):
+    """The main.py cycle reduced to inbox sync + reply, sleeping or waiting for push between cycles."""
+    cycles = 0
+    while True:
+        cycles += 1
+        for stub in sync.poll():
+            message = client.create_message(to="lead@example.com", subject="Re: Question", message_text="Thanks!",
+                                            thread_id=stub['threadId'])
+            client.send_message(message)
+            client.mark_as_read(stub['id'])
+            latencies.append(time.monotonic() - arrivals[stub['id']])
+        sync.commit()
+        if len(latencies) >= count:
+            return cycles
+        if listener is not None:
+            await listener.wait(interval)
+        else:
+            await asyncio.sleep(interval)
+
+
+async def run(label, count, mean_gap, interval, push):
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    client = FakeGmailClient()
+    sync = MailboxSync(client, session, cursor_name='inbox', label_id='INBOX', resync_query="is:unread",
+                       required_labels=('INBOX', 'UNREAD'))
+    arrivals = {}
+    latencies = []
+
+    listener = publisher = None
+    if push:
+        listener = await PushListener(host="127.0.0.1").start()
+        publisher = FakePublisher(listener.url)
+    try:
+        start = time.perf_counter()
+        _, cycles = await asyncio.gather(
+            deliver_mail(client, publisher, count, mean_gap, arrivals),
+            agent_loop(client, sync, listener, interval, count, arrivals, latencies),
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        if push:
+            await publisher.aclose()
+            await listener.stop()
+
+    latencies.sort()
+    p90 = latencies[int(len(latencies) * 0.9) - 1]
+    print(f"{label:<26} replies={len(latencies):<4} median={statistics.median(latencies) * 1000:8.1f}ms "
+          f"p90={p90 * 1000:8.1f}ms sync_cycles={cycles:<4} gmail_calls={client.round_trips:<5} wall={elapsed:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receipt-to-reply latency: interval polling vs push notifications")
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--mean-gap", type=float, default=0.5, help="mean seconds between incoming messages")
+    parser.add_argument("--poll-interval", type=float, default=3.0,
+                        help="poll interval in seconds (main.py uses 30; scaled down to keep the run short)")
+    parser.add_argument("--fallback-interval", type=float, default=30.0, help="fallback poll interval with push")
+    args = parser.parse_args()
+
+    asyncio.run(run(f"poll every {args.poll_interval:g}s", args.messages, args.mean_gap, args.poll_interval, push=False))
+    asyncio.run(run("push + fallback poll", args.messages, args.mean_gap, args.fallback_interval, push=True))
+
+
+if __name__ == "__main__":
+    main()
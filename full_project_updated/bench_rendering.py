@@ -0,0 +1,50 @@
+import re
+import timeit
+from rendering import render_html
+
+SAMPLE = (
+    "Subject: Re: Your enquiry\n\n"
+    "Hi Jane,\n\n"
+    "Thanks for getting back to us! **Build Your Socials** can help you grow with *very little effort*.\n"
+    "Here is what we offer:\n"
+    "- Content planning\n"
+    "- Weekly reporting\n\n"
+    "Book a call here: [our calendar](https://example.com/book?a=1&b=2)\n\n"
+    "Best regards,\nThe Team"
+) * 3
+
+# The same reply without lists or links, which the old renderer ignored anyway
+PLAIN_SAMPLE = (
+    "Subject: Re: Your enquiry\n\n"
+    "Hi Jane,\n\n"
+    "Thanks for getting back to us! **Build Your Socials** can help you grow with *very little effort*.\n"
+    "We plan your content, post it and send you a weekly report.\n\n"
+    "Best regards,\nThe Team"
+) * 3
+
+
+def legacy_render(reply_text):
+    """The old nested markdown_to_html, kept as the reference render_html must match."""
+    import html as html_lib
+    lines = reply_text.splitlines()
+    filtered_lines = [line for line in lines if not line.strip().lower().startswith('subject:')]
+    text = '\n'.join(filtered_lines).strip()
+    text = html_lib.escape(text)
+    text = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', text)
+    text = re.sub(r'\*(.+?)\*', r'<em>\1</em>', text)
+    return text.replace('\n', '<br>')
+
+
+def main():
+    # Output equivalence with legacy_render is checked in test_rendering.py
+    number = 20000
+    for sample_label, sample in (("with lists and links", SAMPLE), ("plain", PLAIN_SAMPLE)):
+        print(sample_label)
+        for label, fn in (("legacy", legacy_render), ("render_html", render_html)):
+            # Best of five, so a busy machine does not decide the comparison
+            seconds = min(timeit.repeat(lambda: fn(sample), number=number, repeat=5))
+            print(f"  {label:<12} {seconds / number * 1e6:.1f} us per reply")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import os
+import zlib
+from sqlalchemy import select, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from agent_state import conversation_bodies
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Codec for new bodies: zstd when the zstandard package is installed, zlib otherwise
+# (also when BODY_CODEC=zstd is set without it)
+BODY_CODEC = os.getenv("BODY_CODEC", "zstd" if zstandard else "zlib")
+# Bodies shorter than this (in bytes) are stored as-is; compressing them saves nothing
+BODY_COMPRESS_MIN_BYTES = int(os.getenv("BODY_COMPRESS_MIN_BYTES", "256"))
+# Compression level for zlib (0-9) and zstd (1-22)
+BODY_COMPRESS_LEVEL = int(os.getenv("BODY_COMPRESS_LEVEL", "6"))
+
+
+def compress_body(text):
+    """(codec, bytes) for a message body."""
+    data = (text or "").encode("utf-8")
+    if len(data) < BODY_COMPRESS_MIN_BYTES:
+        return "raw", data
+    if BODY_CODEC == "zstd" and zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=BODY_COMPRESS_LEVEL).compress(data)
+    return "zlib", zlib.compress(data, BODY_COMPRESS_LEVEL)
+
+
+def decompress_body(codec, data):
+    """Text of a body stored with codec (the conversation_bodies.codec of its row)."""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Conversation body is zstd-compressed; install the zstandard package to read it")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif codec == "zlib":
+        data = zlib.decompress(data)
+    elif codec != "raw":
+        raise ValueError(f"Unknown conversation body codec: {codec!r}")
+    return data.decode("utf-8")
+
+
+def body_rows(bodies):
+    """conversation_bodies rows for (message_id, text) pairs."""
+    rows = []
+    for message_id, text in bodies:
+        codec, data = compress_body(text)
+        rows.append({'message_id': message_id, 'codec': codec, 'body': data, 'size': len(text or "")})
+    return rows
+
+
+def insert_bodies(conn, rows):
+    """
+    Insert body rows on a session or connection, skipping message IDs that already have one.
+
+    The body of a message never changes, so an existing row is always the same body.
+    """
+    if not rows:
+        return
+    dialect = (conn.get_bind() if isinstance(conn, Session) else conn).dialect.name
+    if dialect == 'postgresql':
+        statement = postgresql.insert(conversation_bodies).on_conflict_do_nothing()
+    elif dialect == 'sqlite':
+        statement = sqlite.insert(conversation_bodies).on_conflict_do_nothing()
+    else:
+        statement = insert(conversation_bodies)
+    conn.execute(statement, rows)
+
+
+def store_body(session, message_id, text):
+    """
+    Store a conversation body compressed in conversation_bodies, without committing.
+
+    Returns the value to put in the conversation row's own body column: empty
+    once the body is stored, or the text itself for a message without a
+    message ID, which has no key to store it under.
+    """
+    if not message_id or not text:
+        return text
+    insert_bodies(session, body_rows([(message_id, text)]))
+    return ""
+
+
+def load_bodies(session, conversations):
+    """
+    {conversation id: body} for conversations loaded with the body column deferred.
+
+    One query for all stored bodies; rows not moved to conversation_bodies yet
+    (migration 0006 pending, no message ID) fall back to their own column.
+    """
+    message_ids = [conv.message_id for conv in conversations if conv.message_id]
+    stored = {}
+    if message_ids:
+        for message_id, codec, data in session.execute(
+            select(conversation_bodies.c.message_id, conversation_bodies.c.codec, conversation_bodies.c.body)
+            .where(conversation_bodies.c.message_id.in_(message_ids))
+        ):
+            stored[message_id] = decompress_body(codec, data)
+    return {conv.id: stored[conv.message_id] if conv.message_id in stored else conv.body for conv in conversations}
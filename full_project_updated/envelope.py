@@ -0,0 +1,64 @@
+from dataclasses import dataclass
+from email.utils import getaddresses
+
+# Header name (lower case) -> MessageEnvelope field
+_HEADER_FIELDS = {
+    'from': 'from_email',
+    'to': 'to_email',
+    'cc': 'cc_email',
+    'subject': 'subject',
+    'message-id': 'message_id',
+    'date': 'date',
+}
+
+
+def parse_addresses(value):
+    """Return the lower-cased addresses in an address header, e.g. '"Doe, Jane" <jane@x.com>, bob@y.com'."""
+    if not value:
+        return []
+    return [address.lower() for _, address in getaddresses([value]) if address]
+
+
+@dataclass(slots=True)
+class MessageEnvelope:
+    """
+    The routing headers of one Gmail message.
+
+    Replaces the raw Gmail JSON dicts kept around during a cycle with a
+    compact slotted record built in a single pass over the headers.
+    """
+    msg_id: str
+    thread_id: str
+    from_email: str = None
+    to_email: str = None
+    cc_email: str = None
+    subject: str = None
+    message_id: str = None
+    date: str = None
+
+    @classmethod
+    def from_gmail(cls, msg):
+        msg_id = msg['id']
+        thread_id = msg.get('threadId')
+        if not thread_id:
+            thread_id = msg_id
+
+        # Validate thread_id format (should be a non-empty string)
+        if not isinstance(thread_id, str) or not thread_id.strip():
+            print(f"Invalid thread_id detected: {thread_id}. Using msg_id instead.")
+            thread_id = msg_id
+
+        envelope = cls(msg_id, thread_id)
+        for header in msg.get('payload', {}).get('headers', []):
+            field = _HEADER_FIELDS.get(header.get('name', '').lower())
+            if field:
+                setattr(envelope, field, header.get('value', ''))
+        return envelope
+
+    @property
+    def to_addresses(self):
+        return parse_addresses(self.to_email)
+
+    @property
+    def cc_addresses(self):
+        return parse_addresses(self.cc_email)
@@ -0,0 +1,343 @@
+import base64
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+import httplib2
+from googleapiclient.errors import HttpError
+
+# A well-formed Message-ID: <left@right> with no brackets or spaces inside
+_MESSAGE_ID = re.compile(r'<[^<>@\s]+@[^<>@\s]+>')
+
+
+class _Request:
+    def __init__(self, client, fn):
+        self._client = client
+        self._fn = fn
+
+    def execute(self):
+        self._client._round_trip()
+        return self._fn()
+
+
+class _FakeBatch:
+    def __init__(self, client, callback):
+        self._client = client
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, request_id=None):
+        self._requests.append((request_id or str(len(self._requests) + 1), request))
+
+    def execute(self):
+        # The whole batch costs a single round trip
+        self._client._round_trip()
+        for request_id, request in self._requests:
+            try:
+                response, exception = request._fn(), None
+            except HttpError as e:
+                response, exception = None, e
+            self._callback(request_id, response, exception)
+
+
+class _FakeHistory:
+    def __init__(self, client):
+        self._client = client
+
+    def list(self, userId, startHistoryId, historyTypes=None, labelId=None, pageToken=None, maxResults=100):
+        return _Request(self._client, lambda: self._client._history_page(int(startHistoryId), labelId, pageToken, maxResults))
+
+
+class _FakeMessages:
+    def __init__(self, client):
+        self._client = client
+
+    def get(self, userId, id, format='full', metadataHeaders=None):
+        return _Request(self._client, lambda: self._client._get_message(id, format, metadataHeaders))
+
+    def list(self, userId, q="", maxResults=100, pageToken=None):
+        return _Request(self._client, lambda: self._client._search(q))
+
+
+class _FakeThreads:
+    def __init__(self, client):
+        self._client = client
+
+    def get(self, userId, id, format='full', metadataHeaders=None):
+        return _Request(self._client, lambda: self._client._get_thread(id))
+
+
+class _FakeUsers:
+    def __init__(self, client):
+        self._client = client
+
+    def getProfile(self, userId):
+        return _Request(self._client, lambda: {'emailAddress': self._client.address, 'historyId': str(self._client.history_id)})
+
+    def history(self):
+        return _FakeHistory(self._client)
+
+    def messages(self):
+        return _FakeMessages(self._client)
+
+    def threads(self):
+        return _FakeThreads(self._client)
+
+    def watch(self, userId, body):
+        return _Request(self._client, lambda: self._client._watch(body))
+
+
+class _FakeService:
+    def __init__(self, client):
+        self._client = client
+
+    def users(self):
+        return _FakeUsers(self._client)
+
+    def new_batch_http_request(self, callback=None):
+        return _FakeBatch(self._client, callback)
+
+
+class FakeGmailClient:
+    """
+    In-memory stand-in for email_handler.gmail_client.GmailClient.
+
+    Implements the GmailClient methods used by main.py plus the small part of
+    the googleapiclient service (getProfile, history.list, messages.get,
+    messages.list by rfc822msgid, threads.get, watch and batch requests) used by
+    MailboxSync, get_messages_batch and the outbox, so the agent
+    loop can run offline. Every HTTP round trip is counted in round_trips and
+    can be slowed down by latency seconds to mimic the network.
+    """
+
+    def __init__(self, address="agent@example.com", latency=0.0):
+        self.address = address
+        self.latency = latency
+        self.round_trips = 0
+        self.messages = {}
+        self.sent = []
+        self.history = []
+        self.history_id = 1000
+        self.oldest_history_id = self.history_id
+        self.watch_topic = None
+        self.service = _FakeService(self)
+        self._ids = itertools.count(1)
+
+    # Seeding helpers
+
+    def add_message(self, sender, to, subject, body, labels=('INBOX', 'UNREAD'), cc=None, thread_id=None,
+                    message_id=None):
+        msg_id = f"msg{next(self._ids)}"
+        headers = [
+            {'name': 'From', 'value': sender},
+            {'name': 'To', 'value': to},
+            {'name': 'Subject', 'value': subject},
+            {'name': 'Message-ID', 'value': message_id or f"<{msg_id}@fake.gmail>"},
+        ]
+        if cc:
+            headers.append({'name': 'Cc', 'value': cc})
+        data = base64.urlsafe_b64encode(body.encode()).decode()
+        msg = {
+            'id': msg_id,
+            'threadId': thread_id or msg_id,
+            'labelIds': list(labels),
+            'internalDate': str(int(time.time() * 1000)),
+            'payload': {'mimeType': 'text/plain', 'headers': headers, 'body': {'data': data}},
+        }
+        self.messages[msg_id] = msg
+        self.history_id += 1
+        self.history.append({
+            'id': str(self.history_id),
+            'messagesAdded': [{'message': {'id': msg_id, 'threadId': msg['threadId'], 'labelIds': list(labels)}}],
+        })
+        return msg_id
+
+    def expire_history(self):
+        """Make every history ID issued so far invalid, like Gmail does after ~a week."""
+        self.oldest_history_id = self.history_id + 1
+
+    # GmailClient API
+
+    def list_messages(self, query=""):
+        self._round_trip()
+        # Only the label terms are honoured; date filters like "after:" are ignored
+        terms = query.split()
+        if "is:unread" in terms:
+            wanted = 'UNREAD'
+        elif "in:sent" in terms:
+            wanted = 'SENT'
+        else:
+            wanted = None
+        return [
+            {'id': m['id'], 'threadId': m['threadId']}
+            for m in reversed(list(self.messages.values()))
+            if wanted is None or wanted in m['labelIds']
+        ]
+
+    def get_full_message(self, msg_id):
+        self._round_trip()
+        return self.messages.get(msg_id)
+
+    def create_message(self, to, subject, message_text, thread_id=None, in_reply_to=None, references=None):
+        return {
+            'to': to,
+            'subject': subject,
+            'message_text': message_text,
+            'threadId': thread_id,
+            'in_reply_to': in_reply_to,
+            'references': references,
+        }
+
+    def send_message(self, message):
+        self._round_trip()
+        self.sent.append(message)
+        # Sent mail shows up in its thread (and the Sent label) like in Gmail
+        # Gmail replaces a malformed Message-ID with one of its own
+        message_id = message.get('message_id')
+        if message_id and not _MESSAGE_ID.fullmatch(message_id):
+            message_id = None
+        msg_id = self.add_message(self.address, message['to'], message['subject'] or '', message['message_text'],
+                                  labels=('SENT',), thread_id=message.get('threadId'), message_id=message_id)
+        return {'id': msg_id, 'threadId': self.messages[msg_id]['threadId']}
+
+    def mark_as_read(self, msg_id):
+        self._round_trip()
+        msg = self.messages.get(msg_id)
+        if msg and 'UNREAD' in msg['labelIds']:
+            msg['labelIds'].remove('UNREAD')
+
+    # Fake service internals
+
+    def _round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get_message(self, msg_id, format, metadata_headers):
+        msg = self.messages.get(msg_id)
+        if msg is None:
+            raise HttpError(httplib2.Response({'status': 404}), b'{"error": {"code": 404, "message": "Not Found"}}')
+        if format != 'metadata':
+            return msg
+        wanted = {h.lower() for h in metadata_headers or []}
+        headers = [h for h in msg['payload']['headers'] if not wanted or h['name'].lower() in wanted]
+        return {
+            'id': msg['id'],
+            'threadId': msg['threadId'],
+            'labelIds': list(msg['labelIds']),
+            'payload': {'mimeType': msg['payload']['mimeType'], 'headers': headers},
+        }
+
+    def _search(self, query):
+        # Only the rfc822msgid: term is supported
+        wanted = query.split("rfc822msgid:", 1)[1].split()[0] if "rfc822msgid:" in query else None
+        matches = [
+            {'id': m['id'], 'threadId': m['threadId']}
+            for m in self.messages.values()
+            if wanted is None or any(
+                h['name'] == 'Message-ID' and h['value'] == wanted for h in m['payload']['headers']
+            )
+        ]
+        return {'messages': matches, 'resultSizeEstimate': len(matches)} if matches else {'resultSizeEstimate': 0}
+
+    def _get_thread(self, thread_id):
+        messages = [
+            {'id': m['id'], 'threadId': m['threadId'], 'labelIds': list(m['labelIds']), 'internalDate': m['internalDate']}
+            for m in self.messages.values() if m['threadId'] == thread_id
+        ]
+        if not messages:
+            raise HttpError(httplib2.Response({'status': 404}), b'{"error": {"code": 404, "message": "Not Found"}}')
+        return {'id': thread_id, 'messages': messages}
+
+    def _watch(self, body):
+        self.watch_topic = body['topicName']
+        expiration = int((time.time() + 7 * 24 * 3600) * 1000)
+        return {'historyId': str(self.history_id), 'expiration': str(expiration)}
+
+    def _history_page(self, start_history_id, label_id, page_token, max_results):
+        if start_history_id < self.oldest_history_id:
+            raise HttpError(httplib2.Response({'status': 404}), b'{"error": {"code": 404, "message": "Requested entity was not found."}}')
+
+        records = [
+            r for r in self.history
+            if int(r['id']) > start_history_id and (
+                label_id is None
+                or any(label_id in a['message']['labelIds'] for a in r['messagesAdded'])
+            )
+        ]
+        offset = int(page_token or 0)
+        page = records[offset:offset + max_results]
+        response = {'history': page, 'historyId': str(self.history_id)}
+        if offset + max_results < len(records):
+            response['nextPageToken'] = str(offset + max_results)
+        return response
+
+
+_MESSAGE_PATH = re.compile(r'^/gmail/v1/users/[^/]+/messages/([^/]+)$')
+_HISTORY_PATH = re.compile(r'^/gmail/v1/users/[^/]+/history$')
+_PROFILE_PATH = re.compile(r'^/gmail/v1/users/[^/]+/profile$')
+
+
+class FakeGmailHttp:
+    """
+    httplib2.Http stand-in that serves a FakeGmailClient over the Gmail REST URIs.
+
+    Handles messages.get, history.list and getProfile, which is enough to run
+    googleapiclient (or gmail_transport.RetryingHttp directly) against it.
+    Rate limiting is injected as 429 rateLimitExceeded responses: the first
+    fail_first requests fail, then each request fails with probability
+    error_rate. Injected failures are counted in throttled.
+    """
+
+    def __init__(self, client, error_rate=0.0, fail_first=0, retry_after=None, seed=None):
+        self.client = client
+        self.error_rate = error_rate
+        self.fail_first = fail_first
+        self.retry_after = retry_after
+        self.requests = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        self.client._round_trip()
+        with self._lock:
+            self.requests += 1
+            throttle = self.fail_first > 0 or self._random.random() < self.error_rate
+            if throttle:
+                self.fail_first = max(0, self.fail_first - 1)
+                self.throttled += 1
+        if throttle:
+            headers = {'retry-after': str(self.retry_after)} if self.retry_after is not None else {}
+            return _response(429, {'error': {
+                'code': 429,
+                'message': 'User-rate limit exceeded.',
+                'errors': [{'reason': 'rateLimitExceeded'}],
+            }}, headers)
+
+        parts = urlsplit(uri)
+        query = parse_qs(parts.query)
+        try:
+            if method == 'GET' and _MESSAGE_PATH.match(parts.path):
+                msg_id = _MESSAGE_PATH.match(parts.path).group(1)
+                return _response(200, self.client._get_message(
+                    msg_id, query.get('format', ['full'])[0], query.get('metadataHeaders')
+                ))
+            if method == 'GET' and _HISTORY_PATH.match(parts.path):
+                return _response(200, self.client._history_page(
+                    int(query['startHistoryId'][0]), query.get('labelId', [None])[0],
+                    query.get('pageToken', [None])[0], int(query.get('maxResults', ['100'])[0])
+                ))
+            if method == 'GET' and _PROFILE_PATH.match(parts.path):
+                return _response(200, {'emailAddress': self.client.address, 'historyId': str(self.client.history_id)})
+        except HttpError as e:
+            return e.resp, e.content
+        return _response(404, {'error': {'code': 404, 'message': f"No fake route for {method} {parts.path}"}})
+
+
+def _response(status, payload, headers=None):
+    resp = httplib2.Response({'status': status, 'content-type': 'application/json; charset=UTF-8', **(headers or {})})
+    return resp, json.dumps(payload).encode()
@@ -0,0 +1,66 @@
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+from datetime import datetime, timezone
+import httpx
+
+
+def push_envelope(email_address, history_id, message_id, subscription="projects/local/subscriptions/gmail-push"):
+    """Request body of a Pub/Sub push delivery carrying a Gmail notification."""
+    data = json.dumps({'emailAddress': email_address, 'historyId': history_id}).encode()
+    return {
+        'message': {
+            'data': base64.b64encode(data).decode(),
+            'messageId': str(message_id),
+            'publishTime': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+        },
+        'subscription': subscription,
+    }
+
+
+class FakePublisher:
+    """
+    Local stand-in for the Pub/Sub push subscription in front of push_listener.
+
+    publish() POSTs the same envelope Pub/Sub would send when Gmail reports a
+    mailbox change, so push ingestion can be exercised offline. Pair it with
+    fake_gmail.FakeGmailClient: add a message, then publish its history_id.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.published = 0
+        self._ids = itertools.count(1)
+        self._client = httpx.AsyncClient(timeout=5.0)
+
+    async def publish(self, email_address, history_id):
+        response = await self._client.post(self.url, json=push_envelope(email_address, history_id, next(self._ids)))
+        response.raise_for_status()
+        self.published += 1
+        return response.status_code
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+async def publish(args):
+    publisher = FakePublisher(args.url)
+    try:
+        status = await publisher.publish(args.email, args.history_id)
+        print(f"Published history {args.history_id} for {args.email} to {args.url}: HTTP {status}")
+    finally:
+        await publisher.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send one fake Gmail push notification to the agent")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/", help="push endpoint, with ?token=... if set")
+    parser.add_argument("--email", default="agent@buildyoursocials.com")
+    parser.add_argument("--history-id", type=int, default=1)
+    asyncio.run(publish(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import asyncio
+import heapq
+import os
+import time
+from datetime import timedelta
+from collections import defaultdict, deque
+from outbox import follow_up_key, FOLLOW_UP, SENT, RECORDED
+from leases import lead_resource
+from lead_store import canonical_email
+from follow_up_schedule import get_leads_needing_followup
+
+# Follow-ups generated at once; the LLM client's GENERATE_CONCURRENCY still caps requests in flight
+FOLLOW_UP_CONCURRENCY = int(os.getenv("FOLLOW_UP_CONCURRENCY", "8"))
+# Follow-ups handed to Gmail per second, across all recipients
+FOLLOW_UP_SENDS_PER_SECOND = float(os.getenv("FOLLOW_UP_SENDS_PER_SECOND", "2"))
+# Minimum seconds between two follow-ups to the same recipient domain
+FOLLOW_UP_DOMAIN_INTERVAL_SECONDS = float(os.getenv("FOLLOW_UP_DOMAIN_INTERVAL_SECONDS", "5"))
+# A dispatch pass only takes the follow-ups the pacing lets out within this many seconds; the
+# rest stay due and are picked up by a later pass, so the main loop is never held up for long
+FOLLOW_UP_DISPATCH_WINDOW_SECONDS = float(os.getenv("FOLLOW_UP_DISPATCH_WINDOW_SECONDS", "5"))
+
+
+def recipient_domain(email):
+    """Domain of an address or a header like '"Jane" <jane@x.com>', so both pace together."""
+    return canonical_email(email).rsplit('@', 1)[-1]
+
+
+class FollowUpDispatcher:
+    """
+    Sends the follow-ups of a cohort of due leads in three batched steps.
+
+    1. Every eligible follow-up the pacing allows in this pass is queued in
+       the outbox with one insert and one commit (keys already queued are
+       left to outbox recovery).
+    2. Completions are generated concurrently, at most concurrency at a time,
+       and stored together in one commit.
+    3. Sends are paced: at most sends_per_second overall, and at least
+       domain_interval seconds apart per recipient domain. The next send
+       always goes to the domain that may be sent to earliest, so one big
+       domain does not hold up the others. Each send runs through
+       Outbox.deliver(), so the claim, send and record steps keep the
+       outbox's exactly-once guarantee. The pacing is checked inside the
+       outbox's Gmail slot right before the send; a send that has to wait
+       gives the slot back while it waits.
+
+    A pass only takes the follow-ups whose turn comes within window seconds.
+    The others are postponed until then and picked up by a later pass, so a
+    big cohort or one busy domain never holds up inbound replies. Pacing
+    state is kept across passes, so back-to-back cohorts do not burst the
+    same domain.
+    """
+
+    def __init__(self, session, outbox, leases, follow_ups, concurrency=FOLLOW_UP_CONCURRENCY,
+                 sends_per_second=FOLLOW_UP_SENDS_PER_SECOND, domain_interval=FOLLOW_UP_DOMAIN_INTERVAL_SECONDS,
+                 window=FOLLOW_UP_DISPATCH_WINDOW_SECONDS, clock=time.monotonic):
+        self.session = session
+        self.outbox = outbox
+        self.leases = leases
+        self.follow_ups = follow_ups
+        self.concurrency = concurrency
+        self.send_interval = 1 / sends_per_second if sends_per_second else 0
+        self.domain_interval = domain_interval
+        self.window = window
+        self._clock = clock
+        self._next_send = 0
+        self._next_by_domain = {}
+
+    async def dispatch(self, due_leads):
+        """Follow up the due leads this worker holds a lease on. Returns how many follow-ups were delivered."""
+        print(f"Checking {len(due_leads)} lead(s) due a follow-up...")
+
+        # Re-check only the due leads against their conversations
+        candidates = get_leads_needing_followup(self.session, lead_ids=due_leads)
+        # Due but no longer eligible (closed, answered elsewhere, ...): recompute their schedule
+        self.follow_ups.refresh(set(due_leads) - {item['lead'].id for item in candidates})
+
+        # Leads leased by another worker are followed up by that worker
+        held = self.leases.acquire_many({lead_resource(item['lead'].email) for item in candidates})
+        try:
+            mine = [item for item in candidates if lead_resource(item['lead'].email) in held]
+            now, scheduled = self._clock(), self._send_order(mine)
+            # Only what the pacing lets out within the window; the rest come back after it
+            batch = [item for item, at in scheduled if at <= now + self.window]
+            later = [(item['lead'].id, at) for item, at in scheduled if at > now + self.window]
+
+            # One follow-up per last message: the key makes a crash or retry resume
+            # the queued follow-up instead of generating and sending another one
+            entries = [
+                {
+                    'key': follow_up_key(item['last_conversation'].message_id),
+                    'kind': FOLLOW_UP,
+                    'lead_id': item['lead'].id,
+                    'thread_id': item['last_conversation'].thread_id,
+                    'recipient': item['lead'].email,
+                    'parent_message_id': item['last_conversation'].message_id,
+                    'sender': item['last_conversation'].sender,  # Our email
+                    'subject': item['last_conversation'].subject,
+                }
+                for item in batch
+            ]
+            queued = self.outbox.enqueue_many(entries)
+            generated = await self.outbox.generate_many(queued, self.concurrency)
+            deliveries = [self._deliver(entry['key']) for entry in entries if entry['key'] in generated]
+            states = await asyncio.gather(*deliveries)
+            delivered = sum(1 for state in states if state in (SENT, RECORDED))
+
+            # A follow-up that was recorded rescheduled its lead; the rest are checked again after the delay
+            self.follow_ups.postpone(item['lead'].id for item in batch)
+            if later:
+                # Due again when the first of them may be sent
+                next_turn = max(0.0, min(at for _, at in later) - self._clock())
+                self.follow_ups.postpone((lead_id for lead_id, _ in later), delay=timedelta(seconds=next_turn))
+        finally:
+            self.leases.release(held)
+
+        print(f"Follow-ups: {len(queued)} queued, {len(generated)} generated, {delivered} delivered, "
+              f"{len(later)} left for a later pass")
+        return delivered
+
+    def _send_order(self, items):
+        """(item, clock time it may be sent) in pacing order, the earliest sendable domain first."""
+        pending = defaultdict(deque)
+        for item in items:
+            pending[recipient_domain(item['lead'].email)].append(item)
+        # Domains ordered by when they may next be sent to
+        now = self._clock()
+        ready = [(max(now, self._next_by_domain.get(domain, 0)), domain) for domain in pending]
+        heapq.heapify(ready)
+
+        order = []
+        next_send = self._next_send
+        while ready:
+            not_before, domain = heapq.heappop(ready)
+            at = max(not_before, next_send)
+            next_send = at + self.send_interval
+            order.append((pending[domain].popleft(), at))
+            if pending[domain]:
+                heapq.heappush(ready, (at + self.domain_interval, domain))
+        return order
+
+    def _pace(self, entry):
+        """0 after reserving the send slot for this entry, else seconds to wait before asking again."""
+        domain = recipient_domain(entry.recipient)
+        now = self._clock()
+        wait = max(self._next_send, self._next_by_domain.get(domain, 0)) - now
+        if wait > 0:
+            return wait
+        self._next_send = now + self.send_interval
+        self._next_by_domain[domain] = now + self.domain_interval
+        return 0
+
+    async def _deliver(self, key):
+        try:
+            return await self.outbox.deliver(key, pace=self._pace)
+        except Exception as e:
+            print(f"Outbox: failed to deliver {key}: {e}")
+            return None
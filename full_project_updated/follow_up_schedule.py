@@ -0,0 +1,202 @@
+import heapq
+import os
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, func, select, update, insert, delete
+from sqlalchemy.orm import defer
+from database.models import Conversation, Lead
+from agent_state import follow_up_schedule
+
+# Minutes after our last message before a lead that has not answered gets a follow-up
+# (2 for testing; 24 * 60 in production)
+FOLLOW_UP_DELAY_MINUTES = int(os.getenv("FOLLOW_UP_DELAY_MINUTES", "2"))
+# The table is also checked this often, for follow-ups scheduled by other workers
+FOLLOW_UP_RECHECK_SECONDS = int(os.getenv("FOLLOW_UP_RECHECK_SECONDS", "60"))
+# Most due leads handled per cycle; the rest are picked up on the next one
+FOLLOW_UP_BATCH_SIZE = int(os.getenv("FOLLOW_UP_BATCH_SIZE", "500"))
+
+
+def awaiting_follow_up(session, cutoff_time=None, lead_ids=None):
+    """
+    (lead, last conversation) for every active lead whose last message is ours
+    and unanswered, optionally only when it is older than cutoff_time and only
+    for lead_ids.
+    """
+    conversations = select(Conversation)
+    if lead_ids is not None:
+        # Only rank the conversations of these leads and of the threads they are in
+        lead_threads = select(Conversation.thread_id).where(Conversation.lead_id.in_(lead_ids))
+        conversations = conversations.where(or_(
+            Conversation.lead_id.in_(lead_ids), Conversation.thread_id.in_(lead_threads)
+        ))
+    scoped = conversations.subquery('scoped_conversations')
+
+    # Rank every conversation within its lead and within its thread (newest first)
+    ranked = session.query(
+        scoped.c.id.label('conversation_id'),
+        scoped.c.lead_id,
+        scoped.c.thread_id,
+        scoped.c.sender,
+        scoped.c.timestamp,
+        scoped.c.last_message_owner,
+        func.row_number().over(
+            partition_by=scoped.c.lead_id, order_by=scoped.c.timestamp.desc()
+        ).label('lead_rank'),
+        func.row_number().over(
+            partition_by=scoped.c.thread_id, order_by=scoped.c.timestamp.desc()
+        ).label('thread_rank'),
+    ).cte('ranked_conversations')
+    latest = ranked.alias('latest')
+    thread_latest = ranked.alias('thread_latest')
+
+    # One query for all eligible leads and their latest conversation:
+    # 1. Lead is active (Initial or Progress)
+    # 2. Last message was from us (agent)
+    # 3. It is older than the cutoff, if one is given
+    # 4. The last message in that thread is not from the lead
+    # Only conversation metadata is needed here; never load the bodies
+    query = session.query(Lead, Conversation).options(defer(Conversation.body)).join(
+        latest, and_(latest.c.lead_id == Lead.id, latest.c.lead_rank == 1)
+    ).join(
+        Conversation, Conversation.id == latest.c.conversation_id
+    ).join(
+        thread_latest, and_(thread_latest.c.thread_id == latest.c.thread_id, thread_latest.c.thread_rank == 1)
+    ).filter(
+        Lead.status.in_(['Initial', 'Progress']),
+        latest.c.last_message_owner == 'agent',
+        thread_latest.c.sender != Lead.email,
+    )
+    if cutoff_time is not None:
+        query = query.filter(latest.c.timestamp < cutoff_time)
+    return query.all()
+
+
+def get_leads_needing_followup(session, lead_ids=None):
+    cutoff_time = datetime.utcnow() - timedelta(minutes=FOLLOW_UP_DELAY_MINUTES)
+    leads_to_followup = [
+        {'lead': lead, 'last_conversation': conversation}
+        for lead, conversation in awaiting_follow_up(session, cutoff_time, lead_ids)
+    ]
+
+    print("NO OF LEADS TO FOLLOWUP - ", len(leads_to_followup))
+    return leads_to_followup
+
+
+class FollowUpScheduler:
+    """
+    When each lead is next due a follow-up, instead of re-checking every lead each cycle.
+
+    schedule() is called when our message to a lead is recorded and stores
+    the due time in the follow_up_schedule table (indexed on
+    next_follow_up_at); cancel() when the lead's answer is stored. An
+    in-memory heap of due times tells the main loop how long it may sleep and
+    whether anything is due at all, so due() usually costs nothing; when the
+    earliest entry is due, or every recheck_seconds for entries other workers
+    scheduled, one indexed range query returns the due leads.
+
+    The heap may hold stale entries (cancelled or rescheduled leads); the
+    table is authoritative. seed() rebuilds the table from the conversation
+    history at startup, and refresh() re-derives single leads whose stored
+    due time turned out to be wrong.
+    """
+
+    def __init__(self, session, delay_minutes=FOLLOW_UP_DELAY_MINUTES, recheck_seconds=FOLLOW_UP_RECHECK_SECONDS):
+        self.session = session
+        self.delay = timedelta(minutes=delay_minutes)
+        self.recheck_seconds = recheck_seconds
+        self._heap = []
+        self._next_check = 0
+
+    def seed(self):
+        """Rebuild the schedule from the conversations of every active lead."""
+        rows = self._rows(awaiting_follow_up(self.session))
+        self.session.execute(delete(follow_up_schedule))
+        if rows:
+            self.session.execute(insert(follow_up_schedule), rows)
+        self.session.commit()
+        self._heap = [(row['next_follow_up_at'], row['lead_id']) for row in rows]
+        heapq.heapify(self._heap)
+        self._next_check = 0
+        print(f"Scheduled follow-ups for {len(rows)} lead(s)")
+
+    def refresh(self, lead_ids):
+        """Recompute the schedule of these leads from their conversations."""
+        lead_ids = set(lead_ids)
+        if not lead_ids:
+            return
+        rows = self._rows(awaiting_follow_up(self.session, lead_ids=lead_ids))
+        self.session.execute(delete(follow_up_schedule).where(follow_up_schedule.c.lead_id.in_(lead_ids)))
+        if rows:
+            self.session.execute(insert(follow_up_schedule), rows)
+        self.session.commit()
+        for row in rows:
+            heapq.heappush(self._heap, (row['next_follow_up_at'], row['lead_id']))
+
+    def schedule(self, lead_id, message_id, sent_at=None):
+        """Our message_id was sent to the lead at sent_at; follow up after the delay unless they answer."""
+        now = datetime.utcnow()
+        due = (sent_at or now) + self.delay
+        values = {'message_id': message_id, 'next_follow_up_at': due, 'updated_at': now}
+        result = self.session.execute(
+            update(follow_up_schedule).where(follow_up_schedule.c.lead_id == lead_id).values(**values)
+        )
+        if result.rowcount == 0:
+            self.session.execute(insert(follow_up_schedule).values(lead_id=lead_id, **values))
+        self.session.commit()
+        heapq.heappush(self._heap, (due, lead_id))
+
+    def cancel(self, lead_id):
+        """The lead answered; no follow-up until our next message is recorded."""
+        self.session.execute(delete(follow_up_schedule).where(follow_up_schedule.c.lead_id == lead_id))
+        self.session.commit()
+
+    def postpone(self, lead_ids, delay=None):
+        """Push still-due leads back by delay (the follow-up delay by default), e.g. after their follow-up was queued."""
+        lead_ids = set(lead_ids)
+        if not lead_ids:
+            return
+        now = datetime.utcnow()
+        due = now + (self.delay if delay is None else delay)
+        # Leads rescheduled meanwhile (their follow-up was recorded) are left alone
+        self.session.execute(
+            update(follow_up_schedule)
+            .where(follow_up_schedule.c.lead_id.in_(lead_ids), follow_up_schedule.c.next_follow_up_at <= now)
+            .values(next_follow_up_at=due, updated_at=now)
+        )
+        self.session.commit()
+        for lead_id in lead_ids:
+            heapq.heappush(self._heap, (due, lead_id))
+
+    def due(self, limit=FOLLOW_UP_BATCH_SIZE):
+        """Up to limit lead ids whose follow-up is due now, earliest first."""
+        now = datetime.utcnow()
+        heap_due = bool(self._heap) and self._heap[0][0] <= now
+        if not heap_due and time.monotonic() < self._next_check:
+            return []
+        self._next_check = time.monotonic() + self.recheck_seconds
+        while self._heap and self._heap[0][0] <= now:
+            heapq.heappop(self._heap)
+        due = list(self.session.execute(
+            select(follow_up_schedule.c.lead_id)
+            .where(follow_up_schedule.c.next_follow_up_at <= now)
+            .order_by(follow_up_schedule.c.next_follow_up_at)
+            .limit(limit)
+        ).scalars())
+        if len(due) == limit:
+            # More may be waiting; look again next cycle
+            self._next_check = 0
+        return due
+
+    def seconds_until_next(self):
+        """Seconds until the earliest known follow-up is due, or None if none is scheduled."""
+        if not self._heap:
+            return None
+        return max(0.0, (self._heap[0][0] - datetime.utcnow()).total_seconds())
+
+    def _rows(self, awaiting):
+        now = datetime.utcnow()
+        return [
+            {'lead_id': lead.id, 'message_id': conversation.message_id,
+             'next_follow_up_at': (conversation.timestamp or now) + self.delay, 'updated_at': now}
+            for lead, conversation in awaiting
+        ]
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, insert, delete, func
+from agent_state import generation_cache
+from llm_client import generate_reply_async, DEFAULT_MODEL
+
+# Cached completions older than this are regenerated
+CACHE_TTL_SECONDS = int(os.getenv("GENERATION_CACHE_TTL_SECONDS", str(24 * 3600)))
+# Entries kept before the least recently used ones are evicted
+CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "5000"))
+# Evict once every this many writes instead of on every put
+EVICT_EVERY = 50
+
+_TRAILING_SPACE = re.compile(r'[ \t]+$', re.MULTILINE)
+_INNER_SPACE = re.compile(r'[ \t]{2,}')
+_BLANK_RUNS = re.compile(r'\n{3,}')
+
+
+def normalize_prompt(prompt):
+    """Collapse whitespace differences that do not change what the model is asked."""
+    text = prompt.replace('\r\n', '\n').replace('\r', '\n')
+    text = _TRAILING_SPACE.sub('', text)
+    text = _INNER_SPACE.sub(' ', text)
+    return _BLANK_RUNS.sub('\n\n', text).strip()
+
+
+def cache_key(prompt, settings):
+    """sha256 of the model, the output-affecting settings and the normalized prompt."""
+    params = settings.as_kwargs()
+    # The timeout does not change the completion
+    params.pop('timeout', None)
+    params['model'] = params.get('model') or DEFAULT_MODEL
+    material = json.dumps({'params': params, 'prompt': normalize_prompt(prompt)}, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class GenerationCache:
+    """
+    Content-addressed cache of LLM completions in the generation_cache table.
+
+    A completion is stored as soon as it is generated, so a reply whose send
+    failed (or whose process crashed before sending) is reused on the retry
+    instead of paying for the model call again. Callers discard() the entry
+    once the reply went out. Entries expire after ttl seconds and the table
+    is trimmed to max_entries by last use.
+    """
+
+    def __init__(self, session, ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.session = session
+        self.ttl = timedelta(seconds=ttl)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+    async def generate(self, prompt, settings):
+        """Return (key, reply_text), calling the model only on a cache miss."""
+        key = cache_key(prompt, settings)
+        cached = self.get(key)
+        if cached is not None:
+            print(f"Reusing cached generation {key[:12]}")
+            return key, cached
+        reply_text = await generate_reply_async(prompt, **settings.as_kwargs())
+        self.put(key, reply_text)
+        return key, reply_text
+
+    def get(self, key):
+        now = datetime.utcnow()
+        row = self.session.execute(
+            select(generation_cache.c.response, generation_cache.c.created_at)
+            .where(generation_cache.c.key == key)
+        ).first()
+        if row is None or row.created_at < now - self.ttl:
+            self.misses += 1
+            return None
+        self.session.execute(
+            update(generation_cache).where(generation_cache.c.key == key).values(last_used_at=now)
+        )
+        self.session.commit()
+        self.hits += 1
+        return row.response
+
+    def put(self, key, response):
+        now = datetime.utcnow()
+        values = {'response': response, 'created_at': now, 'last_used_at': now}
+        result = self.session.execute(
+            update(generation_cache).where(generation_cache.c.key == key).values(**values)
+        )
+        if result.rowcount == 0:
+            self.session.execute(insert(generation_cache).values(key=key, **values))
+        self.session.commit()
+
+        self._writes += 1
+        if self._writes % EVICT_EVERY == 0:
+            self.evict()
+
+    def discard(self, key):
+        self.session.execute(delete(generation_cache).where(generation_cache.c.key == key))
+        self.session.commit()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones above max_entries."""
+        session = self.session
+        session.execute(delete(generation_cache).where(generation_cache.c.created_at < datetime.utcnow() - self.ttl))
+        excess = (session.execute(select(func.count()).select_from(generation_cache)).scalar() or 0) - self.max_entries
+        if excess > 0:
+            oldest = select(generation_cache.c.key).order_by(generation_cache.c.last_used_at.asc()).limit(excess)
+            session.execute(delete(generation_cache).where(generation_cache.c.key.in_(oldest)))
+        session.commit()
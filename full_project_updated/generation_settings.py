@@ -0,0 +1,53 @@
+import inspect
+import os
+from dataclasses import dataclass, asdict
+
+
+@dataclass(frozen=True)
+class GenerationSettings:
+    """
+    LLM parameters for reply generation, configured once at startup and
+    passed through to llm_client.generate_reply_async.
+
+    Fields left as None are not passed, so the client keeps its own default.
+    The model has no usable default and is required (see require_model).
+    max_tokens is always set: 900 is what every send path has asked for.
+    """
+    model: str = None
+    max_tokens: int = 900
+    temperature: float = None
+    timeout: float = None
+
+    @classmethod
+    def from_env(cls):
+        temperature = os.getenv("OPENAI_TEMPERATURE")
+        timeout = os.getenv("OPENAI_TIMEOUT")
+        return cls(
+            model=os.getenv("OPENAI_MODEL") or None,
+            max_tokens=int(os.getenv("OPENAI_MAX_TOKENS", "900")),
+            temperature=float(temperature) if temperature else None,
+            timeout=float(timeout) if timeout else None,
+        )
+
+    def require_model(self):
+        """
+        Raise ValueError unless a model is set. Called once at startup, so a
+        missing OPENAI_MODEL stops the agent instead of failing every reply.
+        """
+        if not self.model:
+            raise ValueError("No model configured: set OPENAI_MODEL")
+        return self
+
+    def as_kwargs(self, accepted_by=None):
+        """
+        The fields that are set, as keyword arguments. With accepted_by (a
+        function), only the ones it takes, e.g. for ai_handler's
+        generate_reply, which has no timeout parameter.
+        """
+        kwargs = {name: value for name, value in asdict(self).items() if value is not None}
+        if accepted_by is None:
+            return kwargs
+        parameters = inspect.signature(accepted_by).parameters
+        if any(p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters.values()):
+            return kwargs
+        return {name: value for name, value in kwargs.items() if name in parameters}
@@ -0,0 +1,65 @@
+import time
+from gmail_transport import is_retryable, backoff_delay
+
+# Gmail accepts at most 100 calls in one batch request
+BATCH_SIZE = 100
+# Extra rounds for parts of a batch that were rate limited or hit a server error
+BATCH_RETRIES = 3
+
+# Headers needed to route a message (inbox filters, sent-CC harvesting)
+ENVELOPE_HEADERS = ['From', 'To', 'Cc', 'Subject', 'Message-ID', 'Date']
+
+
+def get_messages_batch(gmail_client, ids, format='full', metadata_headers=None):
+    """
+    Fetch many messages with HTTP batch requests instead of one get per message.
+
+    Returns a dict of message id -> message resource. Messages that failed to
+    fetch are left out, so callers can treat a missing id like a falsy
+    get_full_message() result. With format='metadata', only metadata_headers
+    are returned in payload['headers'] (no body). Parts that fail with a
+    429 / rate limit / 5xx error inside an otherwise successful batch are
+    fetched again in a later round after a jittered backoff (the transport
+    only sees the batch response as a whole). If a whole batch request
+    fails, e.g. a 429 / 503 that outlasted the transport's retries or a
+    network error, its messages are left out rather than raising.
+    """
+    service = gmail_client.service
+    messages = {}
+    retry_ids = []
+
+    def on_response(request_id, response, exception):
+        if exception is not None:
+            status = getattr(getattr(exception, 'resp', None), 'status', None)
+            if is_retryable(status, getattr(exception, 'content', None)):
+                retry_ids.append(request_id)
+                return
+            print(f"Failed to fetch message {request_id}: {exception}")
+            return
+        messages[request_id] = response
+
+    pending = list(dict.fromkeys(ids))
+    for attempt in range(BATCH_RETRIES + 1):
+        for start in range(0, len(pending), BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=on_response)
+            for msg_id in pending[start:start + BATCH_SIZE]:
+                request_args = {'userId': 'me', 'id': msg_id, 'format': format}
+                if format == 'metadata' and metadata_headers:
+                    request_args['metadataHeaders'] = metadata_headers
+                batch.add(service.users().messages().get(**request_args), request_id=msg_id)
+            try:
+                batch.execute()
+            except Exception as e:
+                # The batch request as a whole failed after the transport's own retries (or on a
+                # network error): its messages are left out and the caller tries them next cycle
+                print(f"Batch fetch of {len(pending[start:start + BATCH_SIZE])} message(s) failed: {e}")
+
+        if not retry_ids:
+            break
+        pending, retry_ids = retry_ids, []
+        if attempt == BATCH_RETRIES:
+            print(f"Giving up on {len(pending)} message(s) after {BATCH_RETRIES} batch retries")
+            break
+        time.sleep(backoff_delay(attempt))
+
+    return messages
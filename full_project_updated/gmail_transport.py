@@ -0,0 +1,283 @@
+import http.client
+import json
+import os
+import queue
+import random
+import re
+import socket
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+
+# Gmail allows 250 quota units per user per second (a moving average, so short bursts are fine)
+QUOTA_UNITS_PER_SECOND = float(os.getenv("GMAIL_QUOTA_UNITS_PER_SECOND", "250"))
+# Attempts after the first one before a request is given up
+MAX_RETRIES = int(os.getenv("GMAIL_MAX_RETRIES", "5"))
+# Backoff before retry n is a random delay in [0, min(BACKOFF_MAX, BACKOFF_BASE * 2**n)]
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 32.0
+# Seconds before an idle socket read is treated as a failed attempt
+HTTP_TIMEOUT_SECONDS = 60
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+NETWORK_ERRORS = (socket.timeout, ConnectionError, http.client.HTTPException, httplib2.ServerNotFoundError)
+
+# Quota units per Gmail API method; anything unlisted costs DEFAULT_QUOTA_COST
+DEFAULT_QUOTA_COST = 5
+_QUOTA_COSTS = [
+    (re.compile(r'/messages/send$'), 100),
+    (re.compile(r'/drafts/send$'), 100),
+    (re.compile(r'/threads/[^/]+$'), 10),
+    (re.compile(r'/history$'), 2),
+    (re.compile(r'/profile$'), 1),
+    (re.compile(r'/labels(/[^/]+)?$'), 1),
+]
+# Request lines of the parts of a batch request body
+_BATCH_PART = re.compile(r'^(GET|POST|PUT|PATCH|DELETE) (\S+) HTTP/', re.MULTILINE)
+
+
+def quota_cost(method, uri, body=None):
+    """Gmail quota units used by one HTTP request; a batch costs the sum of its parts."""
+    path = urlsplit(uri).path
+    if path.startswith('/batch/'):
+        return sum(quota_cost(part_method, part_uri) for part_method, part_uri in _batch_parts(body)) or 1
+    for pattern, cost in _QUOTA_COSTS:
+        if pattern.search(path):
+            return cost
+    return DEFAULT_QUOTA_COST
+
+
+def is_rate_limited(status, content):
+    """True for 429 and for the 403 rateLimitExceeded / userRateLimitExceeded errors."""
+    if status == 429:
+        return True
+    if status != 403 or not content:
+        return False
+    try:
+        error = json.loads(content).get('error', {})
+    except (ValueError, AttributeError):
+        return False
+    return any(detail.get('reason') in RATE_LIMIT_REASONS for detail in error.get('errors', []))
+
+
+def is_retryable(status, content):
+    return status in RETRY_STATUSES or is_rate_limited(status, content)
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE_SECONDS, cap=BACKOFF_MAX_SECONDS):
+    """Full-jitter exponential backoff for the given retry attempt (0-based)."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _batch_parts(body):
+    if not body:
+        return []
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', 'replace')
+    return _BATCH_PART.findall(body)
+
+
+def _replay_safe(method, uri, body):
+    # A POST that failed mid-flight (5xx, dropped connection) may already have
+    # been applied, e.g. a sent email. Batches of GETs can be replayed.
+    if method.upper() != 'POST':
+        return True
+    if urlsplit(uri).path.startswith('/batch/'):
+        parts = _batch_parts(body)
+        return bool(parts) and all(part_method == 'GET' for part_method, _ in parts)
+    return False
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket sized in Gmail quota units.
+
+    Holds at most capacity units and refills at rate units per second.
+    acquire() blocks until the requested units are available and returns the
+    seconds spent waiting.
+    """
+
+    def __init__(self, rate=QUOTA_UNITS_PER_SECOND, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, units=1):
+        # A request larger than the bucket would wait forever, so it drains it instead
+        units = min(units, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= units:
+                    self._tokens -= units
+                    return waited
+                delay = (units - self._tokens) / self.rate
+            self._sleep(delay)
+            waited += delay
+
+    def drain(self):
+        """Empty the bucket, e.g. after the server reported the quota as exhausted."""
+        with self._lock:
+            self._tokens = 0
+            self._updated = self._clock()
+
+
+class TransportMetrics:
+    """Counters for the Gmail transport, safe to update from worker threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.quota_units = 0
+        self.throttled_seconds = 0.0
+        self.backoff_seconds = 0.0
+        self.retry_reasons = Counter()
+
+    def record_request(self, units, throttled):
+        with self._lock:
+            self.requests += 1
+            self.quota_units += units
+            self.throttled_seconds += throttled
+
+    def record_retry(self, reason, delay):
+        with self._lock:
+            self.retries += 1
+            self.backoff_seconds += delay
+            self.retry_reasons[reason] += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def summary(self):
+        with self._lock:
+            reasons = ', '.join(f"{reason}={count}" for reason, count in sorted(self.retry_reasons.items()))
+            return (
+                f"requests={self.requests} quota_units={self.quota_units} retries={self.retries}"
+                f"{f' ({reasons})' if reasons else ''} failures={self.failures}"
+                f" throttled={self.throttled_seconds:.1f}s backoff={self.backoff_seconds:.1f}s"
+            )
+
+
+class HttpPool:
+    """
+    A pool of keep-alive httplib2.Http objects, one per concurrent request.
+
+    httplib2.Http keeps a connection open per host but is not thread-safe, so
+    each request checks an instance out of the pool and returns it afterwards.
+    At most size instances are created; an instance whose request raised is
+    dropped rather than reused with a half-broken connection.
+    """
+
+    def __init__(self, factory, size=4):
+        self.factory = factory
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=httplib2.DEFAULT_MAX_REDIRECTS, connection_type=None):
+        with self._slots:
+            try:
+                http = self._idle.get_nowait()
+            except queue.Empty:
+                http = self.factory()
+            response = http.request(uri, method=method, body=body, headers=headers,
+                                    redirections=redirections, connection_type=connection_type)
+            self._idle.put(http)
+            return response
+
+
+class RetryingHttp:
+    """
+    httplib2.Http-compatible transport for the googleapiclient Gmail service.
+
+    Every request first takes its cost in Gmail quota units from a token
+    bucket, so bursts (batch fetches, follow-up sends) stay under the per-user
+    quota instead of tripping it. 429s, 403 rateLimitExceeded and 5xx
+    responses, as well as dropped connections, are retried with full-jitter
+    exponential backoff (honouring Retry-After). 5xx and network errors are
+    only retried for requests that are safe to replay. A rate-limit response
+    also empties the bucket, so concurrent requests back off together.
+    Retries and waits are counted in metrics.
+    """
+
+    def __init__(self, http, bucket=None, max_retries=MAX_RETRIES, metrics=None, sleep=time.sleep):
+        self.http = http
+        self.bucket = bucket or TokenBucket()
+        self.max_retries = max_retries
+        self.metrics = metrics or TransportMetrics()
+        self._sleep = sleep
+        # googleapiclient batch requests look for the credentials on the http object
+        self.credentials = None
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=httplib2.DEFAULT_MAX_REDIRECTS, connection_type=None):
+        units = quota_cost(method, uri, body)
+        replay_safe = _replay_safe(method, uri, body)
+        attempt = 0
+        while True:
+            throttled = self.bucket.acquire(units)
+            self.metrics.record_request(units, throttled)
+            try:
+                resp, content = self.http.request(uri, method=method, body=body, headers=headers,
+                                                  redirections=redirections, connection_type=connection_type)
+            except NETWORK_ERRORS as e:
+                if not replay_safe or attempt >= self.max_retries:
+                    self.metrics.record_failure()
+                    raise
+                reason, retry_after = type(e).__name__, None
+            else:
+                if not is_retryable(resp.status, content):
+                    return resp, content
+                rate_limited = is_rate_limited(resp.status, content)
+                if not (rate_limited or replay_safe) or attempt >= self.max_retries:
+                    self.metrics.record_failure()
+                    return resp, content
+                if rate_limited:
+                    self.bucket.drain()
+                reason, retry_after = str(resp.status), _retry_after(resp)
+
+            delay = retry_after if retry_after is not None else backoff_delay(attempt)
+            self.metrics.record_retry(reason, delay)
+            print(f"Gmail {method} {urlsplit(uri).path} failed ({reason}), retry {attempt + 1} in {delay:.2f}s")
+            self._sleep(delay)
+            attempt += 1
+
+
+def _retry_after(resp):
+    value = resp.get('retry-after')
+    if not value:
+        return None
+    try:
+        return min(float(value), BACKOFF_MAX_SECONDS)
+    except ValueError:
+        return None
+
+
+def authorized_transport(credentials, pool_size=4, bucket=None, max_retries=MAX_RETRIES):
+    """Pooled, rate-limited, retrying transport that signs requests with the OAuth credentials."""
+    pool = HttpPool(lambda: AuthorizedHttp(credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT_SECONDS)),
+                    size=pool_size)
+    transport = RetryingHttp(pool, bucket=bucket, max_retries=max_retries)
+    transport.credentials = credentials
+    return transport
+
+
+def build_gmail_service(transport):
+    """Gmail API service whose requests (single and batch) all go through transport."""
+    return build('gmail', 'v1', http=transport, cache_discovery=False)
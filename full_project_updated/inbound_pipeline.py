@@ -0,0 +1,222 @@
+import asyncio
+import os
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from database.db_handler import add_conversation
+from database.models import Conversation
+from gmail_batch import get_messages_batch, ENVELOPE_HEADERS
+from mime_body import extract_body
+from body_store import store_body
+from envelope import MessageEnvelope
+from outbox import reply_key, transition, REPLY, RECEIVED, RECORDED
+from leases import lead_resource
+from lead_store import LeadDirectory
+
+# Messages with this address in CC are left for a human
+EXECUTIVE_EMAIL = 'executive@buildyoursocials.com'
+# Gmail calls in flight at once (also the size of the transport's connection pool)
+GMAIL_CONCURRENCY = int(os.getenv("GMAIL_CONCURRENCY", "1"))
+# Cycles a message that could not be fetched is retried in before it is dropped
+FETCH_ATTEMPTS = 3
+
+
+class InboundPipeline:
+    """
+    Handles one cycle of new inbox messages as an asyncio pipeline:
+    fetch -> parse -> outbox delivery (generate -> send -> record).
+
+    Each reply is queued in the durable outbox under the Message-ID it
+    answers, so it is sent at most once even across crashes and restarts.
+    Completions go through the async LLM client (which caps requests in
+    flight) and blocking Gmail calls run in worker threads behind a semaphore,
+    so a slow completion no longer stalls the rest of the inbox. Messages from
+    the same lead are processed in arrival order under a per-lead lock, and
+    only for leads this worker holds a lease on; messages of leads leased by
+    another worker are left to it and checked again next cycle. Database work
+    stays on the event loop thread, so the shared SQLAlchemy session is never
+    used from two threads at once. A message is only marked processed once
+    its full body was fetched; fetch failures are retried in the next cycles.
+    """
+
+    def __init__(self, session, gmail_client, processed_messages, outbox, leases, gmail_concurrency=GMAIL_CONCURRENCY,
+                 follow_ups=None):
+        self.session = session
+        self.gmail_client = gmail_client
+        self.processed_messages = processed_messages
+        self.outbox = outbox
+        self.leases = leases
+        self.follow_ups = follow_ups
+        # Senders are matched on their canonical address, recent ones from memory
+        self.leads = LeadDirectory(session)
+        self._gmail_slots = asyncio.Semaphore(gmail_concurrency)
+        self._lead_locks = defaultdict(asyncio.Lock)
+        # Gmail message id -> cycles it failed to fetch in so far
+        self._unfetched = {}
+        # Messages of leads leased by another worker, re-checked until stored
+        self._deferred = set()
+
+    async def run_cycle(self, message_ids):
+        # Messages that failed to fetch last cycle are tried again, since the sync cursor has moved past them
+        message_ids = list(dict.fromkeys([*self._unfetched, *self._deferred, *message_ids]))
+        self._deferred = set()
+        candidates = await self.fetch(message_ids)
+        if not candidates:
+            return
+
+        held = self.leases.acquire_many({lead_resource(candidate.from_email) for candidate in candidates})
+        try:
+            await self._run_leased([c for c in candidates if lead_resource(c.from_email) in held])
+        finally:
+            self.leases.release(held)
+            self._lead_locks.clear()
+
+        for candidate in candidates:
+            if lead_resource(candidate.from_email) not in held:
+                self._deferred.add(candidate.msg_id)
+        if self._deferred:
+            print(f"Left {len(self._deferred)} message(s) to workers holding their leads")
+
+    async def _run_leased(self, candidates):
+        if not candidates:
+            return
+        full_messages = await self._gmail_call(
+            get_messages_batch, self.gmail_client, [candidate.msg_id for candidate in candidates]
+        )
+        fetched = []
+        for candidate in candidates:
+            if candidate.msg_id in full_messages:
+                fetched.append(candidate)
+            else:
+                self._fetch_failed(candidate.msg_id)
+        candidates = fetched
+        for candidate in candidates:
+            self.processed_messages.add(candidate.msg_id)
+            self._unfetched.pop(candidate.msg_id, None)
+
+        tasks = [self.process(candidate, full_messages.get(candidate.msg_id)) for candidate in candidates]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for candidate, result in zip(candidates, results):
+            if isinstance(result, Exception):
+                print(f"Failed to process message {candidate.msg_id}: {result}")
+
+    async def fetch(self, message_ids):
+        """Fetch headers for all new messages in one batch and keep the ones we should reply to."""
+        new_ids = [msg_id for msg_id in message_ids if msg_id not in self.processed_messages]
+        metadata = await self._gmail_call(
+            get_messages_batch, self.gmail_client, new_ids, format='metadata', metadata_headers=ENVELOPE_HEADERS
+        )
+
+        candidates = []
+        for msg_id in new_ids:
+            msg = metadata.pop(msg_id, None)
+            if not msg:
+                self._fetch_failed(msg_id)
+                continue
+            envelope = MessageEnvelope.from_gmail(msg)
+
+            # Check if executive@buildyoursocials.com is in CC, skip processing if yes
+            if EXECUTIVE_EMAIL in envelope.cc_addresses:
+                print(f"Skipping message {msg_id} because {EXECUTIVE_EMAIL} is in CC")
+                self._unfetched.pop(msg_id, None)
+                continue
+
+            if not envelope.from_email:
+                print(f"Warning: 'From' header not found for message {msg_id}")
+                self._unfetched.pop(msg_id, None)
+                continue
+
+            candidates.append(envelope)
+
+        # Drop messages already stored in the database, e.g. handled before a restart
+        stored = self.processed_messages.stored(candidate.message_id for candidate in candidates)
+        if stored:
+            print(f"Skipping {len(stored)} message(s) already stored in the database")
+            for candidate in candidates:
+                if candidate.message_id in stored:
+                    self.processed_messages.add(candidate.msg_id)
+                    self._unfetched.pop(candidate.msg_id, None)
+            candidates = [candidate for candidate in candidates if candidate.message_id not in stored]
+
+        return candidates
+
+    async def process(self, candidate, full_msg):
+        # Acquire the lead lock before any other await so same-lead messages keep their order
+        async with self._lead_locks[lead_resource(candidate.from_email)]:
+            if not full_msg:
+                return
+
+            key = self.parse(candidate, full_msg)
+            if key is None:
+                return
+
+            # Generate, send and record through the outbox, so a crash at any point resumes instead of re-sending
+            await self.outbox.deliver(key)
+
+    def parse(self, candidate, full_msg):
+        """Queue the reply and store the inbound message. Returns the outbox key, or None if there is nothing to send."""
+        session = self.session
+        from_email = candidate.from_email
+        message_id = candidate.message_id
+
+        # Extract body: plain text preferred over html, nested multiparts handled, size capped
+        body = extract_body(full_msg.get('payload', {}))
+
+        # Get or create lead
+        lead = self.leads.get_or_create(from_email)
+
+        # Create reply email using original subject without "Re:" prefix
+        clean_subject = candidate.subject
+        if clean_subject and clean_subject.lower().startswith("re:"):
+            clean_subject = clean_subject[3:].strip()
+
+        # Queue before storing the message: both steps are idempotent, so a crash
+        # in between is repaired when the message is seen again
+        key = reply_key(message_id or candidate.msg_id)
+        self.outbox.enqueue(
+            key, REPLY, lead.id, candidate.thread_id, from_email,
+            source_msg_id=candidate.msg_id,
+            parent_message_id=message_id,
+            sender=candidate.to_email,  # our email address (recipient of original)
+            subject=clean_subject,
+        )
+
+        # Save conversation; message_id is unique, so a duplicate means it was already stored.
+        # The body goes compressed to conversation_bodies and is committed with the row.
+        try:
+            add_conversation(session, lead, candidate.thread_id, message_id, from_email,
+                             candidate.to_email, candidate.subject, store_body(session, message_id, body),
+                             datetime.utcnow())
+        except IntegrityError:
+            session.rollback()
+            print(f"Message {message_id} from {from_email} already stored.")
+        else:
+            # The lead answered, so no follow-up is due until our reply is recorded
+            if self.follow_ups is not None:
+                self.follow_ups.cancel(lead.id)
+
+        # Check if a reply was already recorded for this specific message outside the outbox
+        existing_reply = session.query(Conversation).filter(
+            Conversation.lead_id == lead.id,
+            Conversation.parent_message_id == message_id,
+            Conversation.sender != from_email  # sender not the lead, i.e., our reply
+        ).first()
+
+        if existing_reply:
+            print(f"Reply already sent to {from_email} for message {message_id}, skipping.")
+            transition(session, key, RECEIVED, RECORDED)
+            return None
+
+        return key
+
+    def _fetch_failed(self, msg_id):
+        attempts = self._unfetched.get(msg_id, 0) + 1
+        if attempts >= FETCH_ATTEMPTS:
+            print(f"Dropping message {msg_id} after {attempts} failed fetch attempts")
+            self._unfetched.pop(msg_id, None)
+        else:
+            self._unfetched[msg_id] = attempts
+
+    async def _gmail_call(self, fn, *args, **kwargs):
+        async with self._gmail_slots:
+            return await asyncio.to_thread(fn, *args, **kwargs)
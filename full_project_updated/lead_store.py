@@ -0,0 +1,147 @@
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from sqlalchemy import MetaData, Column, String, select, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from database.db_handler import get_lead_by_email, add_lead
+from database.models import Lead
+from envelope import parse_addresses
+
+# Addresses checked and inserted per statement
+LEAD_BATCH_SIZE = int(os.getenv("LEAD_BATCH_SIZE", "500"))
+# Canonical address -> lead id entries kept in memory
+LEAD_CACHE_SIZE = int(os.getenv("LEAD_CACHE_SIZE", "10000"))
+
+# The leads table plus the email_canonical column added by migration 0005,
+# which database.models does not know about
+leads = Lead.__table__.to_metadata(MetaData())
+leads.append_column(Column("email_canonical", String(255)))
+
+
+def canonical_email(value):
+    """Bare lower-cased address of an address or a From header like '"Jane Doe" <Jane@X.com>'."""
+    addresses = parse_addresses(value)
+    return addresses[0] if addresses else value.strip().lower()
+
+
+def normalize_emails(emails):
+    """Bare, lower-cased addresses from addresses or header values, deduplicated in first-seen order."""
+    seen = {}
+    for value in emails:
+        for address in parse_addresses(value):
+            seen.setdefault(address, None)
+    return list(seen)
+
+
+def _insert_ignoring_conflicts(session, table):
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return insert(table)
+
+
+def bulk_upsert_leads(session, emails, batch_size=LEAD_BATCH_SIZE):
+    """
+    Make sure a lead exists for every address, in one round of statements per batch.
+
+    Addresses are normalized and deduplicated in memory. Each batch costs one
+    SELECT for the leads already stored and one INSERT ... ON CONFLICT DO
+    NOTHING for the rest, so a concurrent insert of the same address (another
+    worker, or the inbox pipeline) is skipped instead of failing the batch.
+    Everything is committed once at the end. Returns the addresses added.
+    """
+    addresses = normalize_emails(emails)
+    added = []
+    for start in range(0, len(addresses), batch_size):
+        batch = addresses[start:start + batch_size]
+        existing = set(session.execute(
+            select(leads.c.email_canonical).where(leads.c.email_canonical.in_(batch))
+        ).scalars())
+        rows = [
+            {'email': address, 'email_canonical': address, 'status': 'Initial'}
+            for address in batch if address not in existing
+        ]
+        if not rows:
+            continue
+        statement = _insert_ignoring_conflicts(session, leads).values(rows).returning(leads.c.email)
+        added.extend(session.execute(statement).scalars())
+    session.commit()
+    return added
+
+
+@dataclass(slots=True, frozen=True)
+class LeadRecord:
+    """The lead fields the agent loop reads, cached without an ORM instance."""
+    id: int
+    email: str
+
+
+class LeadDirectory:
+    """
+    Lead lookup by canonical address with an in-process LRU cache of leads.
+
+    A lead writing from '"Jane Doe" <jane@x.com>' and later from 'JANE@x.com'
+    is the same lead: lookups go through the unique email_canonical index
+    instead of comparing raw From headers. The cache holds plain LeadRecord
+    values rather than ORM instances, which a commit would expire (every hit
+    would then refresh the row), so leads that write repeatedly cost no
+    query at all. Duplicates are merged by migrations 0004/0005 before the
+    agent starts, so a canonical address maps to one lead for good.
+    """
+
+    def __init__(self, session, capacity=LEAD_CACHE_SIZE):
+        self.session = session
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._leads = OrderedDict()
+
+    def get(self, email):
+        canonical = canonical_email(email)
+        lead = self._leads.get(canonical)
+        if lead is not None:
+            self._leads.move_to_end(canonical)
+            self.hits += 1
+            return lead
+
+        self.misses += 1
+        row = self.session.execute(
+            select(leads.c.id, leads.c.email).where(leads.c.email_canonical == canonical)
+        ).first()
+        if row is None:
+            return None
+        lead = LeadRecord(row.id, row.email)
+        self._remember(canonical, lead)
+        return lead
+
+    def get_or_create(self, email):
+        lead = self.get(email)
+        if lead:
+            return lead
+
+        canonical = canonical_email(email)
+        # Rows the backfill has not seen yet (e.g. written by an older worker) still match on the raw address
+        existing = get_lead_by_email(self.session, email)
+        created = existing or add_lead(self.session, email)
+        lead = LeadRecord(created.id, created.email)
+        try:
+            self.session.execute(update(leads).where(leads.c.id == lead.id).values(email_canonical=canonical))
+            self.session.commit()
+        except IntegrityError:
+            # Another lead already has this address (e.g. stored by another worker meanwhile); use it
+            self.session.rollback()
+            if existing is None:
+                self.session.delete(created)
+                self.session.commit()
+            return self.get(email)
+        self._remember(canonical, lead)
+        return lead
+
+    def _remember(self, canonical, lead):
+        self._leads[canonical] = lead
+        self._leads.move_to_end(canonical)
+        if len(self._leads) > self.capacity:
+            self._leads.popitem(last=False)
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, and_, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from agent_state import leases
+from envelope import parse_addresses
+
+# Seconds a lease lasts without a heartbeat; a crashed worker's leads are taken over after this
+LEASE_TTL_SECONDS = int(os.getenv("LEASE_TTL_SECONDS", "60"))
+# Held leases are renewed this often
+HEARTBEAT_SECONDS = LEASE_TTL_SECONDS / 3
+
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+
+def lead_resource(email):
+    """Lease name for a lead, from a bare address or a From header like 'Jane <jane@x.com>'."""
+    addresses = parse_addresses(email)
+    return f"lead:{addresses[0] if addresses else email.strip().lower()}"
+
+
+class LeaseManager:
+    """
+    Partitions leads between agent workers that share one database.
+
+    A worker only handles a lead while it holds the lead's row in the leases
+    table. Leases expire after ttl seconds unless renewed by the heartbeat
+    task, so the leads of a worker that died are picked up by the others.
+
+    On Postgres a batch of leases is claimed in one transaction with
+    SELECT ... FOR UPDATE SKIP LOCKED, so workers never wait on each other's
+    claims; on SQLite (one writer at a time) each lease is claimed with a
+    conditional upsert instead. Either way the claim is atomic: a lease is
+    only taken when it is free, expired or already ours.
+
+    held is shared with the heartbeat's worker thread and only changed under
+    a lock. A lease released while a renewal is running is not reported as
+    lost by it.
+    """
+
+    def __init__(self, session, owner=WORKER_ID, ttl=LEASE_TTL_SECONDS):
+        self.session = session
+        self.owner = owner
+        self.ttl = timedelta(seconds=ttl)
+        self.held = set()
+        # Guards held and _released, which the heartbeat thread reads and updates too
+        self._lock = threading.Lock()
+        # Leases released since the running renewal took its snapshot
+        self._released = set()
+        self._dialect = session.get_bind().dialect.name
+
+    def acquire(self, resource):
+        return resource in self.acquire_many([resource])
+
+    def acquire_many(self, resources):
+        """Claim every lease we can; returns the set of resources now held by this worker."""
+        resources = set(resources)
+        if not resources:
+            return set()
+        if self._dialect == 'postgresql':
+            acquired = self._acquire_skip_locked(resources)
+        else:
+            acquired = {resource for resource in resources if self._acquire_upsert(resource)}
+        with self._lock:
+            self.held |= acquired
+        return acquired
+
+    def release(self, resources):
+        with self._lock:
+            resources = set(resources) & self.held
+            # Dropped before the rows go, so neither a new renewal snapshot nor
+            # one already running counts them as lost
+            self.held -= resources
+            self._released |= resources
+        if not resources:
+            return
+        self.session.execute(
+            delete(leases).where(leases.c.resource.in_(resources), leases.c.owner == self.owner)
+        )
+        self.session.commit()
+
+    def renew(self, session=None):
+        """Extend every lease still held; leases taken over by another worker are dropped from held."""
+        session = session or self.session
+        # A snapshot, so leases acquired or released meanwhile are left alone
+        with self._lock:
+            held = set(self.held)
+            self._released = set()
+        if not held:
+            return
+        now = datetime.utcnow()
+        session.execute(
+            update(leases)
+            .where(leases.c.resource.in_(held), leases.c.owner == self.owner)
+            .values(expires_at=now + self.ttl, heartbeat_at=now)
+        )
+        session.commit()
+        still_held = set(session.execute(
+            select(leases.c.resource).where(leases.c.resource.in_(held), leases.c.owner == self.owner)
+        ).scalars())
+        with self._lock:
+            # Rows released by the main loop meanwhile are gone because of it, not lost
+            lost = held - still_held - self._released
+            self.held -= lost
+        if lost:
+            print(f"Lost {len(lost)} lease(s) to other workers: {sorted(lost)[:5]}")
+
+    async def heartbeat(self, session, interval=HEARTBEAT_SECONDS):
+        """
+        Background task renewing held leases until cancelled.
+
+        Uses its own session, in a worker thread, so a renewal neither waits
+        for the main loop nor rolls back what the main loop has in flight.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.renew, session)
+            except Exception as e:
+                session.rollback()
+                print(f"Lease heartbeat failed: {e}")
+
+    def _available(self, now):
+        return or_(leases.c.expires_at < now, leases.c.owner == self.owner)
+
+    def _acquire_upsert(self, resource):
+        now = datetime.utcnow()
+        values = {'resource': resource, 'owner': self.owner, 'expires_at': now + self.ttl, 'heartbeat_at': now}
+        statement = sqlite.insert(leases).values(**values)
+        statement = statement.on_conflict_do_update(
+            index_elements=[leases.c.resource],
+            set_={'owner': self.owner, 'expires_at': values['expires_at'], 'heartbeat_at': now},
+            where=self._available(now),
+        )
+        self.session.execute(statement)
+        self.session.commit()
+        owner = self.session.execute(select(leases.c.owner).where(leases.c.resource == resource)).scalar()
+        return owner == self.owner
+
+    def _acquire_skip_locked(self, resources):
+        session = self.session
+        now = datetime.utcnow()
+        expires_at = now + self.ttl
+        # Existing leases we may take, skipping rows another worker is claiming right now
+        free = set(session.execute(
+            select(leases.c.resource)
+            .where(and_(leases.c.resource.in_(resources), self._available(now)))
+            .with_for_update(skip_locked=True)
+        ).scalars())
+        if free:
+            session.execute(
+                update(leases).where(leases.c.resource.in_(free))
+                .values(owner=self.owner, expires_at=expires_at, heartbeat_at=now)
+            )
+        existing = set(session.execute(select(leases.c.resource).where(leases.c.resource.in_(resources))).scalars())
+        missing = resources - existing
+        inserted = set()
+        if missing:
+            inserted = set(session.execute(
+                postgresql.insert(leases)
+                .values([{'resource': r, 'owner': self.owner, 'expires_at': expires_at, 'heartbeat_at': now}
+                         for r in missing])
+                .on_conflict_do_nothing(index_elements=[leases.c.resource])
+                .returning(leases.c.resource)
+            ).scalars())
+        session.commit()
+        return free | inserted
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import random
+import httpx
+
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+# Completions allowed in flight at once across the inbox pipeline and follow-ups
+LLM_CONCURRENCY = int(os.getenv("GENERATE_CONCURRENCY", "8"))
+# Attempts after the first one for 429 / 5xx responses and connection errors
+LLM_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+# Backoff before retry n is a random delay in [0, min(BACKOFF_MAX, BACKOFF_BASE * 2**n)]
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+# Seconds allowed to open a connection, separate from the per-call timeout
+CONNECT_TIMEOUT_SECONDS = 10.0
+# Model used when the caller does not pass one; main checks at startup that it is set
+DEFAULT_MODEL = os.getenv("OPENAI_MODEL") or None
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LLMRequestError(Exception):
+    """A completion request failed for good (non-retryable status or retries exhausted)."""
+
+
+class AsyncLLMClient:
+    """
+    Async OpenAI chat-completions client for the agent loop.
+
+    One pooled httpx.AsyncClient is shared by every call, so TLS connections
+    are kept alive instead of being set up per completion. A semaphore caps
+    the requests in flight, each call has its own timeout, and 429 / 5xx
+    responses and connection errors are retried with full-jitter exponential
+    backoff (honouring Retry-After). Nothing blocks the event loop while a
+    completion is generated.
+    """
+
+    def __init__(self, base_url=OPENAI_BASE_URL, api_key=None, concurrency=LLM_CONCURRENCY,
+                 max_retries=LLM_MAX_RETRIES, default_model=DEFAULT_MODEL):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key if api_key is not None else os.getenv("OPENAI_API_KEY", "")
+        self.max_retries = max_retries
+        self.default_model = default_model
+        self.requests = 0
+        self.retries = 0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._concurrency = concurrency
+        self._http = None
+
+    @property
+    def http(self):
+        # Created on first use so the client belongs to the running event loop
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={'Authorization': f"Bearer {self.api_key}"},
+                limits=httpx.Limits(max_connections=self._concurrency, max_keepalive_connections=self._concurrency),
+                timeout=httpx.Timeout(60.0, connect=CONNECT_TIMEOUT_SECONDS),
+            )
+        return self._http
+
+    async def generate_reply(self, prompt, model=None, max_tokens=900, temperature=None, timeout=60.0):
+        """Return the completion text for prompt; takes the same keyword arguments as GenerationSettings."""
+        if not (model or self.default_model):
+            # Never fall back to a model nobody configured
+            raise LLMRequestError("No model configured: set OPENAI_MODEL or pass GenerationSettings.model")
+        payload = {
+            'model': model or self.default_model,
+            'messages': [{'role': 'user', 'content': prompt}],
+            'max_tokens': max_tokens,
+        }
+        if temperature is not None:
+            payload['temperature'] = temperature
+        request_timeout = httpx.Timeout(timeout, connect=min(timeout, CONNECT_TIMEOUT_SECONDS))
+
+        async with self._slots:
+            attempt = 0
+            while True:
+                self.requests += 1
+                try:
+                    response = await self.http.post('/chat/completions', json=payload, timeout=request_timeout)
+                except httpx.TransportError as e:
+                    if attempt >= self.max_retries:
+                        raise LLMRequestError(f"Completion request failed after {attempt + 1} attempts: {e!r}") from e
+                    reason, retry_after = type(e).__name__, None
+                else:
+                    if response.status_code == 200:
+                        return response.json()['choices'][0]['message']['content'].strip()
+                    if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                        raise LLMRequestError(f"Completion request failed with {response.status_code}: {response.text[:200]}")
+                    reason, retry_after = str(response.status_code), _retry_after(response)
+
+                delay = retry_after if retry_after is not None else _backoff_delay(attempt)
+                self.retries += 1
+                print(f"Completion request failed ({reason}), retry {attempt + 1} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+def _backoff_delay(attempt):
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _retry_after(response):
+    value = response.headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return min(float(value), BACKOFF_MAX_SECONDS)
+    except ValueError:
+        return None
+
+
+_default_client = None
+
+
+def default_client():
+    """The process-wide client used by generate_reply_async."""
+    global _default_client
+    if _default_client is None:
+        _default_client = AsyncLLMClient()
+    return _default_client
+
+
+async def generate_reply_async(prompt, **kwargs):
+    """Async counterpart of ai_handler.openai_client.generate_reply on the shared client."""
+    return await default_client().generate_reply(prompt, **kwargs)
@@ -0,0 +1,124 @@
+import calendar
+from googleapiclient.errors import HttpError
+from agent_state import get_cursor, get_cursor_updated_at, set_cursor
+from gmail_transport import is_retryable
+
+# Slack subtracted from the last sync time when narrowing a resync listing
+RESYNC_WINDOW_MARGIN_SECONDS = 3600
+
+
+class MailboxSync:
+    """
+    Incremental view of one Gmail label built on the history API.
+
+    The last seen history ID is stored in the sync_cursors table, so each
+    poll() only returns messages added since the previous cycle. When there is
+    no cursor yet, or Gmail reports the history ID as expired (404), it falls
+    back to a full listing with resync_query and starts a new cursor. With
+    resync_since_last_sync set, a resync after expiry is narrowed with an
+    "after:" filter to mail newer than the last stored cursor.
+
+    Rate limits and server errors are retried by the Gmail transport
+    (gmail_transport.RetryingHttp); if they persist, poll() returns nothing
+    and leaves the cursor alone, so the next cycle picks up the same changes.
+    Other errors are raised.
+
+    Uses the googleapiclient service object behind GmailClient (gmail_client.service).
+    """
+
+    def __init__(self, gmail_client, session, cursor_name, label_id, resync_query, required_labels=None,
+                 resync_since_last_sync=False):
+        self.gmail_client = gmail_client
+        self.session = session
+        self.cursor_name = cursor_name
+        self.label_id = label_id
+        self.resync_query = resync_query
+        self.required_labels = set(required_labels or [label_id])
+        self.resync_since_last_sync = resync_since_last_sync
+        self._pending_history_id = None
+
+    @property
+    def service(self):
+        return self.gmail_client.service
+
+    def poll(self):
+        """Return message stubs ({'id', 'threadId'}) added since the last commit()."""
+        try:
+            return self._poll()
+        except HttpError as e:
+            if not is_retryable(e.resp.status, e.content):
+                raise
+            print(f"Gmail unavailable for the {self.cursor_name} sync ({e.resp.status}), trying again next cycle")
+            self._pending_history_id = None
+            return []
+
+    def _poll(self):
+        history_id = get_cursor(self.session, self.cursor_name)
+        if history_id is None:
+            print(f"No history cursor for {self.cursor_name}, running full resync")
+            return self.full_resync()
+
+        try:
+            messages, latest_history_id = self._list_history(history_id)
+        except HttpError as e:
+            if e.resp.status == 404:
+                print(f"History ID {history_id} expired for {self.cursor_name}, running full resync")
+                return self.full_resync()
+            raise
+
+        self._pending_history_id = latest_history_id
+        return messages
+
+    def full_resync(self):
+        query = self.resync_query
+        if self.resync_since_last_sync:
+            last_sync = get_cursor_updated_at(self.session, self.cursor_name)
+            if last_sync:
+                after = calendar.timegm(last_sync.utctimetuple()) - RESYNC_WINDOW_MARGIN_SECONDS
+                query = f"{query} after:{after}"
+
+        # Take the history ID before listing so nothing added meanwhile is missed
+        profile = self.service.users().getProfile(userId='me').execute()
+        self._pending_history_id = profile.get('historyId')
+        return self.gmail_client.list_messages(query=query)
+
+    def commit(self):
+        """Persist the cursor once the messages from the last poll() are handled."""
+        if self._pending_history_id:
+            set_cursor(self.session, self.cursor_name, self._pending_history_id)
+            self._pending_history_id = None
+
+    def _list_history(self, start_history_id):
+        messages = []
+        seen_ids = set()
+        latest_history_id = start_history_id
+        page_token = None
+
+        while True:
+            request_args = {
+                'userId': 'me',
+                'startHistoryId': start_history_id,
+                'historyTypes': ['messageAdded'],
+                'labelId': self.label_id,
+            }
+            if page_token:
+                request_args['pageToken'] = page_token
+            response = self.service.users().history().list(**request_args).execute()
+            latest_history_id = response.get('historyId', latest_history_id)
+
+            for record in response.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    msg = added.get('message', {})
+                    msg_id = msg.get('id')
+                    if not msg_id or msg_id in seen_ids:
+                        continue
+                    if not self.required_labels.issubset(msg.get('labelIds', [])):
+                        continue
+                    seen_ids.add(msg_id)
+                    messages.append({'id': msg_id, 'threadId': msg.get('threadId')})
+
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+
+        return messages, latest_history_id
@@ -4,6 +4,9 @@ from utils.auth import run_headless_oauth
 from email_handler.gmail_client import GmailClient
 from database.db_handler import init_db, get_session, get_lead_by_email, add_lead, add_conversation
 from ai_handler.openai_client import generate_reply
+from generation_settings import GenerationSettings
+from body_store import load_bodies
+from rendering import render_html, strip_subject_lines
 from ai_handler.prompt_handler import load_prompt_template, build_prompt
 from utils.thread_manager import extract_thread_id
 from datetime import datetime
@@ -23,6 +26,7 @@ async def main():
 
     # Load AI prompt template
     base_prompt = load_prompt_template()
+    generation_settings = GenerationSettings.from_env()
 
     # Load processed message IDs from database to avoid duplicate replies after restart
     session = get_session()
@@ -117,45 +121,24 @@ async def main():
                 Conversation
             ).filter_by(lead_id=lead.id).order_by(Conversation.timestamp.asc()).all()
 
+            # Bodies moved to conversation_bodies by migration 0006 are read from there
+            bodies = load_bodies(session, conversations)
             conversation_history = []
             for conv in conversations:
-                conversation_history.append({"sender": conv.sender, "body": conv.body})
+                conversation_history.append({"sender": conv.sender, "body": bodies[conv.id]})
 
             lead_info = f"Lead email: {from_email}"
             prompt = build_prompt(conversation_history, lead_info, base_prompt)
 
-            # Generate AI reply
-            reply_text = generate_reply(prompt)
-
-            # Generate AI reply with increased max_tokens
-            reply_text = generate_reply(prompt, max_tokens=900)
+            # Generate AI reply (one call, settings configured once at startup)
+            reply_text = generate_reply(prompt, **generation_settings.as_kwargs(generate_reply))
 
             # Remove subject line from reply body if present (more robust)
             if subject:
-                lines = reply_text.splitlines()
-                filtered_lines = [line for line in lines if not line.strip().lower().startswith('subject:')]
-                reply_text = '\n'.join(filtered_lines).strip()
+                reply_text = strip_subject_lines(reply_text)
 
             # Convert markdown-like reply text to HTML for proper email formatting
-            import re
-
-            def markdown_to_html(text):
-                # Escape HTML special characters
-                import html as html_lib
-                text = html_lib.escape(text)
-
-                # Convert **bold** to <strong>bold</strong>
-                text = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', text)
-
-                # Convert *italic* to <em>italic</em>
-                text = re.sub(r'\*(.+?)\*', r'<em>\1</em>', text)
-
-                # Convert line breaks to <br>
-                text = text.replace('\n', '<br>')
-
-                return text
-
-            reply_text_html = markdown_to_html(reply_text)
+            reply_text_html = render_html(reply_text, strip_subject=False)
 
             # Log the final reply text length and preview
             print(f"Reply text length: {len(reply_text_html)}")
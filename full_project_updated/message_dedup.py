@@ -0,0 +1,52 @@
+from collections import OrderedDict
+from database.models import Conversation
+
+# Gmail message IDs remembered in memory by one process
+RECENT_CAPACITY = 10000
+# Message-IDs per IN (...) lookup, kept well below SQLite's bound-parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+
+class ProcessedMessageIndex:
+    """
+    Answers "have we already processed this message?" without loading the
+    whole conversations table at startup.
+
+    Gmail message IDs handled by this process are kept in a bounded LRU with
+    the same `in` / add() interface as the set it replaces. Whether a message
+    is already stored is checked against the database by its RFC Message-ID,
+    one IN query per batch over the unique conversations.message_id index.
+    """
+
+    def __init__(self, session, capacity=RECENT_CAPACITY):
+        self.session = session
+        self.capacity = capacity
+        self._recent = OrderedDict()
+
+    def __contains__(self, msg_id):
+        if msg_id in self._recent:
+            self._recent.move_to_end(msg_id)
+            return True
+        return False
+
+    def __len__(self):
+        return len(self._recent)
+
+    def add(self, msg_id):
+        self._recent[msg_id] = None
+        self._recent.move_to_end(msg_id)
+        if len(self._recent) > self.capacity:
+            self._recent.popitem(last=False)
+
+    def stored(self, message_ids):
+        """Return the subset of RFC Message-IDs that already have a conversation row."""
+        wanted = [message_id for message_id in set(message_ids) if message_id]
+        found = set()
+        for start in range(0, len(wanted), LOOKUP_CHUNK_SIZE):
+            chunk = wanted[start:start + LOOKUP_CHUNK_SIZE]
+            found.update(
+                message_id for (message_id,) in self.session.query(Conversation.message_id).filter(
+                    Conversation.message_id.in_(chunk)
+                )
+            )
+        return found
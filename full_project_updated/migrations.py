@@ -0,0 +1,230 @@
+import argparse
+from collections import defaultdict
+from sqlalchemy import select, insert, update, delete, inspect, bindparam, text, func
+from database.db_handler import init_db, get_session
+from database.models import Conversation, Lead
+from agent_state import init_agent_state, schema_migrations, outbox, follow_up_schedule, thread_summaries
+from lead_store import leads, canonical_email
+from body_store import body_rows, insert_bodies
+
+CONVERSATIONS = Conversation.__tablename__
+# Duplicate conversation rows removed by migration 0003 are kept here
+CONVERSATION_DUPLICATES = "conversation_duplicates"
+# Conversation bodies moved to conversation_bodies per statement by migration 0006
+BODY_MIGRATION_BATCH_SIZE = 1000
+LEADS = Lead.__tablename__
+
+
+def create_indexes(*statements):
+    # CREATE [UNIQUE] INDEX IF NOT EXISTS works the same on SQLite and Postgres
+    def migrate(conn):
+        for statement in statements:
+            conn.execute(text(statement))
+    return migrate
+
+
+def unique_conversation_message_id(conn):
+    """
+    Move repeated copies of a stored message aside, then add the unique index on message_id.
+
+    Copies come from the inbox being processed twice before the index existed;
+    the first row of each message is kept. The others are copied to
+    conversation_duplicates (same columns) before they are deleted, so they
+    can still be inspected.
+    """
+    table = Conversation.__table__
+    duplicated = select(table.c.message_id).where(table.c.message_id.isnot(None)).group_by(
+        table.c.message_id
+    ).having(func.count() > 1)
+    first = select(func.min(table.c.id)).where(table.c.message_id.in_(duplicated)).group_by(table.c.message_id)
+    copies = list(conn.execute(
+        select(table.c.id).where(table.c.message_id.in_(duplicated), table.c.id.notin_(first))
+    ).scalars())
+    if copies:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {CONVERSATION_DUPLICATES} AS SELECT * FROM {CONVERSATIONS} WHERE 1 = 0"
+        ))
+        conn.execute(
+            text(f"INSERT INTO {CONVERSATION_DUPLICATES} SELECT * FROM {CONVERSATIONS} WHERE id IN :ids")
+            .bindparams(bindparam('ids', expanding=True)),
+            {'ids': copies},
+        )
+        conn.execute(delete(table).where(table.c.id.in_(copies)))
+        print(f"Moved {len(copies)} duplicate conversation row(s) to {CONVERSATION_DUPLICATES}")
+    conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_conversations_message_id ON {CONVERSATIONS} (message_id)"))
+
+
+def unique_lead_email(conn):
+    # Leads sharing an address would block the index, so merge them first (0005 then has nothing left to merge)
+    merge_duplicate_leads(conn)
+    conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_leads_email ON {LEADS} (email)"))
+
+
+def merge_duplicate_leads(conn):
+    """
+    Add leads.email_canonical, fill it in, and merge leads that share a canonical address.
+
+    The lead with the lowest id is kept; conversations and outbox entries of
+    the others are moved to it before they are deleted. Follow-up schedules
+    and lead summaries of merged leads are dropped (the schedule is rebuilt at
+    startup, summaries are recomputed on demand).
+    """
+    if 'email_canonical' not in {column['name'] for column in inspect(conn).get_columns(LEADS)}:
+        conn.execute(text(f"ALTER TABLE {LEADS} ADD COLUMN email_canonical VARCHAR(255)"))
+
+    groups = defaultdict(list)
+    for lead_id, email in conn.execute(select(leads.c.id, leads.c.email).order_by(leads.c.id)):
+        if email:
+            groups[canonical_email(email)].append(lead_id)
+
+    merged = 0
+    canonical_rows = []
+    for canonical, lead_ids in groups.items():
+        keep, duplicates = lead_ids[0], lead_ids[1:]
+        if duplicates:
+            conn.execute(update(Conversation.__table__).where(Conversation.__table__.c.lead_id.in_(duplicates))
+                         .values(lead_id=keep))
+            conn.execute(update(outbox).where(outbox.c.lead_id.in_(duplicates)).values(lead_id=keep))
+            conn.execute(delete(follow_up_schedule).where(follow_up_schedule.c.lead_id.in_(duplicates)))
+            conn.execute(delete(thread_summaries).where(
+                thread_summaries.c.context_key.in_([f"lead:{lead_id}" for lead_id in lead_ids])
+            ))
+            conn.execute(delete(leads).where(leads.c.id.in_(duplicates)))
+            merged += len(duplicates)
+        canonical_rows.append({'lead_id': keep, 'canonical': canonical})
+    if canonical_rows:
+        conn.execute(
+            update(leads).where(leads.c.id == bindparam('lead_id')).values(email_canonical=bindparam('canonical')),
+            canonical_rows,
+        )
+    if merged:
+        print(f"Merged {merged} duplicate lead(s) into {len(groups)} canonical address(es)")
+
+    conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_leads_email_canonical ON {LEADS} (email_canonical)"))
+
+
+def move_conversation_bodies(conn):
+    """
+    Move conversation bodies into conversation_bodies, compressed, and blank them in conversations.
+
+    Rows without a message ID keep their body inline. The space freed in the
+    conversations table is reused by new rows; on SQLite, run VACUUM once to
+    shrink the database file itself.
+    """
+    table = Conversation.__table__
+    moved = 0
+    last_id = 0
+    while True:
+        batch = conn.execute(
+            select(table.c.id, table.c.message_id, table.c.body)
+            .where(table.c.id > last_id, table.c.message_id.isnot(None), table.c.body != '')
+            .order_by(table.c.id).limit(BODY_MIGRATION_BATCH_SIZE)
+        ).all()
+        if not batch:
+            break
+        insert_bodies(conn, body_rows((message_id, body) for _, message_id, body in batch))
+        conn.execute(update(table).where(table.c.id.in_([row.id for row in batch])).values(body=''))
+        moved += len(batch)
+        last_id = batch[-1].id
+    if moved:
+        print(f"Moved {moved} conversation bodies to conversation_bodies")
+
+
+# Ordered schema migrations applied on top of database.models / init_db().
+# Each entry runs once in its own transaction and is recorded in schema_migrations.
+MIGRATIONS = [
+    ("0001_conversation_hot_path_indexes", create_indexes(
+        f"CREATE INDEX IF NOT EXISTS ix_conversations_lead_id_timestamp ON {CONVERSATIONS} (lead_id, timestamp)",
+        f"CREATE INDEX IF NOT EXISTS ix_conversations_thread_id_timestamp ON {CONVERSATIONS} (thread_id, timestamp)",
+        f"CREATE INDEX IF NOT EXISTS ix_conversations_parent_message_id_sender ON {CONVERSATIONS} (parent_message_id, sender)",
+    )),
+    ("0002_lead_lookup_indexes", create_indexes(
+        f"CREATE INDEX IF NOT EXISTS ix_leads_email_lookup ON {LEADS} (email)",
+        f"CREATE INDEX IF NOT EXISTS ix_leads_status ON {LEADS} (status)",
+    )),
+    # The outbox and the inbound pipeline rely on this index to store each message once
+    ("0003_unique_conversation_message_id", unique_conversation_message_id),
+    # Lets lead_store.bulk_upsert_leads skip addresses inserted concurrently with ON CONFLICT DO NOTHING
+    ("0004_unique_lead_email", unique_lead_email),
+    ("0005_lead_email_canonical", merge_duplicate_leads),
+    ("0006_conversation_bodies", move_conversation_bodies),
+]
+
+
+class MigrationError(Exception):
+    pass
+
+
+def run_migrations(session):
+    """
+    Upgrade the database in place, applying every migration not yet recorded.
+
+    Raises MigrationError if one fails: the agent must not run without the
+    unique indexes its idempotency depends on. The failed migration was
+    rolled back and is retried on the next start.
+    """
+    init_agent_state(session)
+    engine = session.get_bind()
+
+    with engine.connect() as conn:
+        applied = set(conn.execute(select(schema_migrations.c.name)).scalars())
+
+    for name, migrate in MIGRATIONS:
+        if name in applied:
+            continue
+        try:
+            with engine.begin() as conn:
+                migrate(conn)
+                conn.execute(insert(schema_migrations).values(name=name))
+            print(f"Applied migration {name}")
+        except Exception as e:
+            print(f"Migration {name} failed: {e}")
+            raise MigrationError(f"migration {name} failed: {e}") from e
+
+
+def query_plans(session):
+    """{label: plan lines} for the hot-path lookups, to check they use the indexes."""
+    engine = session.get_bind()
+    explain = "EXPLAIN QUERY PLAN" if engine.dialect.name == "sqlite" else "EXPLAIN"
+    queries = {
+        "conversations by lead": select(Conversation.id).where(Conversation.lead_id == 1).order_by(Conversation.timestamp),
+        "conversations by thread": select(Conversation.id).where(Conversation.thread_id == "t").order_by(Conversation.timestamp),
+        "conversation by message id": select(Conversation.id).where(Conversation.message_id == "m"),
+        "existing reply check": select(Conversation.id).where(
+            Conversation.parent_message_id == "m", Conversation.sender != "lead@example.com"
+        ),
+        "lead by email": select(Lead.id).where(Lead.email == "lead@example.com"),
+        "lead by canonical email": select(leads.c.id).where(leads.c.email_canonical == "lead@example.com"),
+        "leads by status": select(Lead.id).where(Lead.status.in_(["Initial", "Progress"])),
+    }
+    plans = {}
+    with engine.connect() as conn:
+        for label, query in queries.items():
+            sql = str(query.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            # SQLite rows are (id, parent, notused, detail); Postgres rows are the plan text
+            plans[label] = [str(row[-1]) for row in conn.execute(text(f"{explain} {sql}"))]
+    return plans
+
+
+def explain_hot_queries(session):
+    """Print the query plans of the hot-path lookups."""
+    for label, plan in query_plans(session).items():
+        print(f"-- {label}")
+        for line in plan:
+            print("   ", line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upgrade the agent database schema in place")
+    parser.add_argument("--explain", action="store_true", help="print query plans for the hot-path queries")
+    args = parser.parse_args()
+
+    init_db()
+    session = get_session()
+    run_migrations(session)
+    if args.explain:
+        explain_hot_queries(session)
+
+
+if __name__ == "__main__":
+    main()
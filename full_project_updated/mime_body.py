@@ -0,0 +1,87 @@
+import base64
+import codecs
+import os
+import re
+
+# Upper bound on decoded body bytes kept per message
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", "100000"))
+
+_CHARSET = re.compile(r'charset\s*=\s*"?([^";\s]+)', re.IGNORECASE)
+
+
+def _part_headers(part):
+    return {h.get('name', '').lower(): h.get('value', '') for h in part.get('headers', [])}
+
+
+def _is_attachment(part, headers):
+    return bool(part.get('filename')) or headers.get('content-disposition', '').lower().startswith('attachment')
+
+
+def find_body_part(payload):
+    """
+    Walk the MIME tree iteratively (depth first, in document order) and return
+    the part holding the message text: the first inline text/plain part, or the
+    first text/html part if there is no plain text. Handles nested multiparts
+    such as multipart/alternative inside multipart/mixed.
+    """
+    html_part = None
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        children = part.get('parts')
+        if children:
+            stack.extend(reversed(children))
+            continue
+
+        mime_type = part.get('mimeType', '')
+        if not part.get('body', {}).get('data'):
+            continue
+        if mime_type not in ('text/plain', 'text/html') or _is_attachment(part, _part_headers(part)):
+            continue
+        if mime_type == 'text/plain':
+            return part
+        if html_part is None:
+            html_part = part
+    return html_part
+
+
+def decode_part(part, max_bytes=MAX_BODY_BYTES):
+    """
+    Decode a Gmail base64url body part to text in its declared charset.
+
+    Only the base64 characters needed for max_bytes are decoded, so a huge part
+    never turns into a huge string. A multibyte character cut at the limit is
+    dropped rather than replaced.
+    """
+    data = part['body']['data']
+    charset = 'utf-8'
+    match = _CHARSET.search(_part_headers(part).get('content-type', ''))
+    if match:
+        charset = match.group(1).lower()
+    try:
+        decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+    except LookupError:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    # Every 4 base64 characters decode to 3 bytes
+    needed_chars = -(-max_bytes // 3) * 4
+    truncated = len(data) > needed_chars
+    chunk = data[:needed_chars] if truncated else data
+    raw = base64.urlsafe_b64decode(chunk + '=' * (-len(chunk) % 4))
+
+    view = memoryview(raw)
+    if len(view) > max_bytes:
+        view = view[:max_bytes]
+        truncated = True
+    text = decoder.decode(view, final=not truncated)
+    if truncated:
+        print(f"Message body truncated to {max_bytes} bytes")
+    return text
+
+
+def extract_body(payload, max_bytes=MAX_BODY_BYTES):
+    """Return the text body of a Gmail API message payload, or "" if there is none."""
+    part = find_body_part(payload)
+    if part is None:
+        return ""
+    return decode_part(part, max_bytes)
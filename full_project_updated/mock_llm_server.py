@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+
+DEFAULT_REPLY = "Hi,\n\nThanks for getting back to us! **Build Your Socials** would love to help.\n\nBest regards,\nThe Team"
+
+
+class MockLLMServer:
+    """
+    Local stand-in for the OpenAI chat-completions endpoint.
+
+    Serves POST /v1/chat/completions over plain asyncio streams with HTTP/1.1
+    keep-alive, answering after latency seconds with a fixed reply. A share
+    error_rate of the requests gets a 429 (or 500 with server_errors) instead,
+    so client retries can be exercised. Counts requests, connections and the
+    peak number of requests in flight. Use as an async context manager:
+
+        async with MockLLMServer(latency=0.2) as server:
+            client = AsyncLLMClient(base_url=server.base_url, api_key="test", default_model="mock")
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.05, error_rate=0.0, server_errors=False,
+                 reply=DEFAULT_REPLY, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.server_errors = server_errors
+        self.reply = reply
+        self.requests = 0
+        self.errors_injected = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', '0')))
+
+                status, payload, extra_headers = await self._respond(method, path, body)
+                content = json.dumps(payload).encode()
+                head = [f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}",
+                        "Content-Type: application/json",
+                        f"Content-Length: {len(content)}"]
+                head.extend(f"{name}: {value}" for name, value in extra_headers.items())
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + content)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, method, path, body):
+        if method != 'POST' or not path.rstrip('/').endswith('/chat/completions'):
+            return 404, {'error': {'message': f"No route for {method} {path}"}}, {}
+
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+
+        if self._random.random() < self.error_rate:
+            self.errors_injected += 1
+            if self.server_errors:
+                return 500, {'error': {'message': "The server had an error", 'type': 'server_error'}}, {}
+            return 429, {'error': {'message': "Rate limit reached", 'type': 'requests'}}, {'retry-after': '0.05'}
+
+        request = json.loads(body or b'{}')
+        return 200, {
+            'id': f"chatcmpl-mock{next(self._ids)}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'mock'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.reply},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        }, {}
+
+
+async def serve(args):
+    server = MockLLMServer(port=args.port, latency=args.latency, error_rate=args.error_rate)
+    async with server:
+        print(f"Mock LLM server listening on {server.base_url} (set OPENAI_BASE_URL to this)")
+        await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the mock OpenAI chat-completions server")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds before each completion is returned")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 429")
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
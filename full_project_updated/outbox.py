@@ -0,0 +1,406 @@
+import asyncio
+import base64
+import email
+import os
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, insert
+from sqlalchemy.exc import IntegrityError
+from database.db_handler import add_conversation
+from body_store import store_body
+from database.models import Lead
+from ai_handler.prompt_handler import build_prompt, build_follow_up_prompt
+from agent_state import outbox
+from rendering import render_html, strip_subject_lines
+from leases import WORKER_ID, lead_resource
+from envelope import parse_addresses
+
+RECEIVED = 'received'
+GENERATED = 'generated'
+SENDING = 'sending'
+SENT = 'sent'
+RECORDED = 'recorded'
+FAILED = 'failed'
+OPEN_STATES = (RECEIVED, GENERATED, SENDING, SENT)
+
+REPLY = 'reply'
+FOLLOW_UP = 'follow_up'
+
+# Generation or send attempts before an entry is parked as failed for a human to look at
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+# A send claim older than this is treated as abandoned (worker died mid-send) and checked against Gmail
+SEND_CLAIM_TIMEOUT = timedelta(seconds=int(os.getenv("OUTBOX_SEND_CLAIM_TIMEOUT", "300")))
+
+
+def reply_key(message_id):
+    return f"reply:{message_id}"
+
+
+def follow_up_key(last_message_id):
+    return f"follow_up:{last_message_id}"
+
+
+def _entry_uuid(key):
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"outbox:{key}"))
+
+
+def sent_message_id(entry):
+    """Message-ID header of the email sent for an entry; the same on every attempt, and unique to the entry."""
+    # The sender may be a full header ('Build Your Socials <executive@x.com>'); use its bare address
+    addresses = parse_addresses(entry.sender)
+    domain = addresses[0].rsplit('@', 1)[-1] if addresses and '@' in addresses[0] else 'outbox.local'
+    return f"<{_entry_uuid(entry.key)}@{domain}>"
+
+
+def set_message_id(message, message_id):
+    """Stamp a Message-ID header on a message built by GmailClient.create_message ({'raw': ..., 'threadId': ...})."""
+    if 'raw' not in message:
+        # Test doubles that build plain dicts
+        message['message_id'] = message_id
+        return message
+    mime = email.message_from_bytes(base64.urlsafe_b64decode(message['raw']))
+    del mime['Message-ID']
+    mime['Message-ID'] = message_id
+    message['raw'] = base64.urlsafe_b64encode(mime.as_bytes()).decode()
+    return message
+
+
+def enqueue(session, key, kind, lead_id, thread_id, recipient, **fields):
+    """Insert a received entry. Returns False if the key was queued before."""
+    now = datetime.utcnow()
+    try:
+        session.execute(insert(outbox).values(
+            key=key, kind=kind, state=RECEIVED, lead_id=lead_id, thread_id=thread_id, recipient=recipient,
+            attempts=0, created_at=now, updated_at=now, **fields
+        ))
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        return False
+    return True
+
+
+def enqueue_many(session, entries):
+    """Insert received entries (dicts of enqueue() arguments) in one commit. Returns the keys newly queued."""
+    now = datetime.utcnow()
+    keys = [entry['key'] for entry in entries]
+    existing = set(session.execute(select(outbox.c.key).where(outbox.c.key.in_(keys))).scalars()) if keys else set()
+    rows = [
+        {'state': RECEIVED, 'attempts': 0, 'created_at': now, 'updated_at': now, **entry}
+        for entry in entries if entry['key'] not in existing
+    ]
+    if not rows:
+        return set()
+    try:
+        session.execute(insert(outbox), rows)
+        session.commit()
+    except IntegrityError:
+        # Another worker queued some of them meanwhile; fall back to one insert per entry
+        session.rollback()
+        return {entry['key'] for entry in entries if entry['key'] not in existing and enqueue(session, **entry)}
+    return {row['key'] for row in rows}
+
+
+def transition(session, key, from_state, to_state, commit=True, **values):
+    """
+    Compare-and-set the state of an entry. Returns False if it was no longer in from_state.
+    With commit=False the caller commits, e.g. to store a batch of transitions at once.
+    """
+    result = session.execute(
+        update(outbox)
+        .where(outbox.c.key == key, outbox.c.state == from_state)
+        .values(state=to_state, updated_at=datetime.utcnow(), **values)
+    )
+    if commit:
+        session.commit()
+    return result.rowcount == 1
+
+
+class Outbox:
+    """
+    Crash-safe delivery of replies and follow-ups through the outbox table.
+
+    Callers enqueue() an entry under an idempotency key (the Message-ID being
+    answered) and call deliver(). Every step is a compare-and-set on the row's
+    state, so two workers (or a worker and the recovery pass) can never both
+    take the same step:
+
+        received  -> generated   completion stored (and cached)
+        generated -> sending     this worker claims the send
+        sending   -> sent        Gmail accepted the message
+        sent      -> recorded    conversation row written, source marked read
+
+    A failed send goes back to generated and is retried on a later pass, up
+    to MAX_ATTEMPTS. Every attempt sends the same Message-ID header, derived
+    from the key, so a failed send or a claim left in sending by a worker
+    that died mid-send is resolved by searching Gmail for that Message-ID:
+    a crash never leads to a second copy being sent, and nothing else in
+    the thread is mistaken for ours. recover() drives every open
+    entry forward; main runs it at startup and once per cycle. With leases,
+    recover() only touches entries of leads this worker holds a lease on.
+    """
+
+    def __init__(self, session, gmail_client, context_loader, prompt_templates, generation_cache,
+                 generation_settings, leases=None, gmail_concurrency=1, worker_id=WORKER_ID, follow_ups=None):
+        self.session = session
+        self.gmail_client = gmail_client
+        self.context_loader = context_loader
+        self.prompt_templates = prompt_templates
+        self.generation_cache = generation_cache
+        self.generation_settings = generation_settings
+        self.leases = leases
+        self.worker_id = worker_id
+        self.follow_ups = follow_ups
+        self._gmail_slots = asyncio.Semaphore(gmail_concurrency)
+
+    def enqueue(self, key, kind, lead_id, thread_id, recipient, **fields):
+        return enqueue(self.session, key, kind, lead_id, thread_id, recipient, **fields)
+
+    def enqueue_many(self, entries):
+        return enqueue_many(self.session, entries)
+
+    def get(self, key):
+        return self.session.execute(select(outbox).where(outbox.c.key == key)).first()
+
+    async def generate_many(self, keys, concurrency):
+        """
+        Generate the completions of received entries, at most concurrency at a
+        time, and store them together in one commit. Returns the keys generated.
+        """
+        slots = asyncio.Semaphore(concurrency)
+        entries = [entry for entry in (self.get(key) for key in keys) if entry is not None and entry.state == RECEIVED]
+
+        async def generate(entry):
+            async with slots:
+                try:
+                    return entry, await self.generation_cache.generate(self._build_prompt(entry), self.generation_settings)
+                except Exception as e:
+                    print(f"Outbox: generation failed for {entry.key}: {e}")
+                    return entry, e
+
+        results = await asyncio.gather(*(generate(entry) for entry in entries))
+        generated = set()
+        for entry, result in results:
+            if isinstance(result, Exception):
+                self._attempt_failed(entry, RECEIVED, RECEIVED, result)
+                continue
+            cache_key, reply_text = result
+            if transition(self.session, entry.key, RECEIVED, GENERATED, commit=False,
+                          reply_text=reply_text, cache_key=cache_key):
+                generated.add(entry.key)
+        self.session.commit()
+        return generated
+
+    async def recover(self):
+        """Drive every unfinished entry forward, e.g. after a crash or a failed send."""
+        rows = self.session.execute(
+            select(outbox.c.key, outbox.c.recipient).where(outbox.c.state.in_(OPEN_STATES)).order_by(outbox.c.created_at)
+        ).all()
+        held = set()
+        if self.leases is not None:
+            held = self.leases.acquire_many({lead_resource(row.recipient) for row in rows})
+            rows = [row for row in rows if lead_resource(row.recipient) in held]
+        if rows:
+            print(f"Outbox: {len(rows)} unfinished entr{'y' if len(rows) == 1 else 'ies'}")
+        try:
+            for row in rows:
+                try:
+                    await self.deliver(row.key)
+                except Exception as e:
+                    print(f"Outbox: failed to deliver {row.key}: {e}")
+        finally:
+            if held:
+                self.leases.release(held)
+
+    async def deliver(self, key, pace=None):
+        """
+        Move an entry as far as it can go. Returns its final state.
+
+        pace, if given, is called with the entry inside the Gmail slot right
+        before the message is handed to Gmail, so a rate limit it applies
+        holds for the actual sends. It returns 0 to send now, or the seconds
+        to wait; the slot is given back while waiting.
+        """
+        while True:
+            entry = self.get(key)
+            if entry is None:
+                return None
+            if entry.state == RECEIVED:
+                await self._generate(entry)
+            elif entry.state == GENERATED:
+                if not await self._send(entry, pace):
+                    return self.get(key).state
+            elif entry.state == SENDING:
+                if not await self._resolve_claim(entry):
+                    return entry.state
+            elif entry.state == SENT:
+                await self._record(entry)
+            else:
+                return entry.state
+
+    async def _generate(self, entry):
+        try:
+            prompt = self._build_prompt(entry)
+            cache_key, reply_text = await self.generation_cache.generate(prompt, self.generation_settings)
+        except Exception as e:
+            self._attempt_failed(entry, RECEIVED, RECEIVED, e)
+            raise
+        transition(self.session, entry.key, RECEIVED, GENERATED, reply_text=reply_text, cache_key=cache_key)
+
+    def _build_prompt(self, entry):
+        if entry.kind == FOLLOW_UP:
+            # Persisted thread summary plus the last few messages, not the whole thread
+            history = self.context_loader.for_thread(entry.thread_id)
+            base_prompt = self.prompt_templates.render('follow_up', lead_email=entry.recipient)
+            return build_follow_up_prompt(history, {entry.recipient}, base_prompt)
+        # Lead's recent messages plus the persisted summary of older ones
+        history = self.context_loader.for_lead(entry.lead_id)
+        base_prompt = self.prompt_templates.render('base', lead_email=entry.recipient)
+        return build_prompt(history, f"Lead email: {entry.recipient}", base_prompt)
+
+    async def _send(self, entry, pace=None):
+        # Build the message before claiming the send, so a message that cannot be built
+        # counts as a failed attempt instead of leaving a claim behind
+        try:
+            html_body = _html_body(entry)
+            message = set_message_id(self.gmail_client.create_message(
+                to=entry.recipient,
+                subject=entry.subject,
+                message_text=html_body,
+                thread_id=entry.thread_id,
+                in_reply_to=entry.parent_message_id,
+                references=entry.parent_message_id
+            ), sent_message_id(entry))
+        except Exception as e:
+            print(f"Failed to build {entry.kind} to {entry.recipient} for message {entry.parent_message_id}: {e}")
+            self._attempt_failed(entry, GENERATED, GENERATED, e)
+            return False
+
+        if not transition(self.session, entry.key, GENERATED, SENDING,
+                          claimed_by=self.worker_id, claimed_at=datetime.utcnow()):
+            # Another worker claimed it first
+            return False
+
+        # Log the final reply text length and preview
+        print(f"Reply text length: {len(html_body)}")
+        print(f"Reply text preview: {html_body[:200]}")
+
+        try:
+            sent = await self._paced_send(entry, message, pace)
+            if not sent:
+                raise RuntimeError("send_message returned no message")
+        except Exception as e:
+            print(f"Failed to send {entry.kind} to {entry.recipient} for message {entry.parent_message_id}: {e}")
+            # A timeout or error response does not prove Gmail dropped the message, so check before retrying
+            try:
+                sent_id = await self._gmail_call(self._find_sent_copy, entry)
+            except Exception as check_error:
+                print(f"Outbox: could not check {entry.key} against Gmail, leaving it claimed: {check_error}")
+                return False
+            if sent_id:
+                self._mark_sent(entry, sent_id)
+                return True
+            self._attempt_failed(entry, SENDING, GENERATED, e)
+            return False
+
+        print(f"Replied to {entry.recipient} for message {entry.parent_message_id}")
+        self._mark_sent(entry, sent.get('id'))
+        return True
+
+    async def _paced_send(self, entry, message, pace):
+        while True:
+            async with self._gmail_slots:
+                wait = pace(entry) if pace is not None else 0
+                if wait <= 0:
+                    return await asyncio.to_thread(self.gmail_client.send_message, message)
+            await asyncio.sleep(wait)
+
+    def _mark_sent(self, entry, sent_message_id):
+        transition(self.session, entry.key, SENDING, SENT, sent_message_id=sent_message_id)
+        # Sent, so the cached completion is no longer needed for a retry
+        if entry.cache_key:
+            self.generation_cache.discard(entry.cache_key)
+
+    async def _resolve_claim(self, entry):
+        """Settle a send claimed by a worker that went away. Returns False while the claim is still live."""
+        if entry.claimed_at and entry.claimed_at > datetime.utcnow() - SEND_CLAIM_TIMEOUT:
+            return False
+
+        sent_id = await self._gmail_call(self._find_sent_copy, entry)
+        if sent_id:
+            print(f"Outbox: {entry.key} was sent before its worker stopped ({sent_id})")
+            self._mark_sent(entry, sent_id)
+        else:
+            # Counts as an attempt, so an entry whose sends keep dying is parked instead of retried forever
+            print(f"Outbox: {entry.key} was never sent, queueing it again")
+            self._attempt_failed(entry, SENDING, GENERATED, RuntimeError("send claim abandoned"))
+        return True
+
+    def _find_sent_copy(self, entry):
+        """Gmail id of the message sent for this entry (found by its Message-ID header), if any."""
+        response = self.gmail_client.service.users().messages().list(
+            userId='me', q=f"rfc822msgid:{sent_message_id(entry)}"
+        ).execute()
+        messages = response.get('messages', [])
+        return messages[0]['id'] if messages else None
+
+    async def _record(self, entry):
+        session = self.session
+        # Mark the email as read after processing
+        if entry.source_msg_id:
+            await self._gmail_call(self.gmail_client.mark_as_read, entry.source_msg_id)
+
+        # The conversation row's message_id is derived from the key, so recording twice hits the unique index
+        now = datetime.utcnow()
+        message_id = _entry_uuid(entry.key)
+        try:
+            add_conversation(
+                session=session,
+                lead=session.get(Lead, entry.lead_id),
+                thread_id=entry.thread_id,
+                message_id=message_id,
+                parent_message_id=entry.parent_message_id,
+                sender=entry.sender,
+                recipient=entry.recipient,
+                subject=entry.subject,
+                body=store_body(session, message_id, _recorded_body(entry)),
+                timestamp=now,
+                follow_up_status='sent' if entry.kind == FOLLOW_UP else 'pending',
+                last_message_owner='agent',
+                last_message_time=now
+            )
+        except IntegrityError:
+            session.rollback()
+        if self.follow_ups is None:
+            transition(session, entry.key, SENT, RECORDED)
+        elif transition(session, entry.key, SENT, RECORDED, commit=False):
+            # The lead is due a follow-up if this goes unanswered; committed together with the state
+            self.follow_ups.schedule(entry.lead_id, message_id, now)
+        else:
+            session.commit()
+
+    def _attempt_failed(self, entry, from_state, retry_state, error):
+        attempts = entry.attempts + 1
+        to_state = FAILED if attempts >= MAX_ATTEMPTS else retry_state
+        if to_state == FAILED:
+            print(f"Outbox: giving up on {entry.key} after {attempts} attempts")
+        transition(self.session, entry.key, from_state, to_state, attempts=attempts, last_error=str(error)[:1000],
+                   claimed_by=None, claimed_at=None)
+
+    async def _gmail_call(self, fn, *args, **kwargs):
+        async with self._gmail_slots:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+def _html_body(entry):
+    if entry.kind == FOLLOW_UP:
+        return render_html(strip_subject_lines(entry.reply_text), strip_subject=False)
+    # Drop any "Subject:" line the model added when the thread has a subject
+    return render_html(entry.reply_text, strip_subject=bool(entry.subject))
+
+
+def _recorded_body(entry):
+    # Follow-ups have always been stored as text, replies as the HTML that was sent
+    if entry.kind == FOLLOW_UP:
+        return strip_subject_lines(entry.reply_text)
+    return _html_body(entry)
@@ -0,0 +1,156 @@
+import os
+import re
+from html.parser import HTMLParser
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a character estimate
+    tiktoken = None
+
+# Most recent turns passed to the model verbatim (after cleaning)
+RECENT_TURNS = int(os.getenv("PROMPT_RECENT_TURNS", "6"))
+# Token budget for the recent turns
+CONTEXT_TOKEN_BUDGET = int(os.getenv("PROMPT_CONTEXT_TOKENS", "3000"))
+# Token budget for the summary of older turns
+SUMMARY_TOKEN_BUDGET = int(os.getenv("PROMPT_SUMMARY_TOKENS", "400"))
+# Characters kept from each older turn by the default summarize hook, which truncates
+SUMMARY_CHARS_PER_TURN = 200
+
+_encoding = tiktoken.get_encoding("cl100k_base") if tiktoken else None
+
+_BLOCK_TAGS = {'br', 'p', 'div', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'blockquote', 'table'}
+_QUOTE_HEADER = re.compile(r'^\s*On\b.*\bwrote:\s*$', re.IGNORECASE)
+_ORIGINAL_MESSAGE = re.compile(r'^\s*-{2,}\s*(Original Message|Forwarded message)\s*-{2,}', re.IGNORECASE)
+_OUTLOOK_HEADER = re.compile(r'^\s*From:\s.+', re.IGNORECASE)
+_OUTLOOK_FIELD = re.compile(r'^\s*(Sent|Date|To|Subject):\s', re.IGNORECASE)
+_SIGNATURE = re.compile(r'^(--\s?|Sent from my .*)$', re.IGNORECASE)
+_BLANK_RUNS = re.compile(r'\n{3,}')
+
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def truncate_tokens(text, budget, keep='head'):
+    if count_tokens(text) <= budget:
+        return text
+    if _encoding is not None:
+        tokens = _encoding.encode(text)
+        tokens = tokens[:budget] if keep == 'head' else tokens[-budget:]
+        return _encoding.decode(tokens)
+    chars = budget * 4
+    return text[:chars] if keep == 'head' else text[-chars:]
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style', 'head'):
+            self._skip += 1
+        elif tag in _BLOCK_TAGS:
+            self.chunks.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style', 'head'):
+            self._skip = max(0, self._skip - 1)
+        elif tag in _BLOCK_TAGS:
+            self.chunks.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.chunks.append(data)
+
+
+def html_to_text(body):
+    parser = _TextExtractor()
+    parser.feed(body)
+    parser.close()
+    return ''.join(parser.chunks)
+
+
+def clean_body(body):
+    """Strip HTML, quoted replies and signatures from an email body."""
+    if not body:
+        return ""
+    if '<' in body and '>' in body:
+        body = html_to_text(body)
+
+    lines = body.splitlines()
+    kept = []
+    for i, line in enumerate(lines):
+        # Everything below a reply header or signature marker is quoted or boilerplate
+        if _QUOTE_HEADER.match(line) or _ORIGINAL_MESSAGE.match(line) or _SIGNATURE.match(line.rstrip()):
+            break
+        if line.strip().startswith('On ') and i + 1 < len(lines) and _QUOTE_HEADER.match(f"{line} {lines[i + 1]}"):
+            break
+        if _OUTLOOK_HEADER.match(line) and any(_OUTLOOK_FIELD.match(l) for l in lines[i + 1:i + 4]):
+            break
+        if line.lstrip().startswith('>'):
+            continue
+        kept.append(line.rstrip())
+
+    return _BLANK_RUNS.sub('\n\n', '\n'.join(kept)).strip()
+
+
+def summarize_turn(turn):
+    """
+    Default summarize hook. It truncates rather than summarizes: the sender
+    and the first SUMMARY_CHARS_PER_TURN characters of the cleaned body, with
+    no model call.
+    """
+    text = ' '.join(clean_body(turn['body']).split())
+    if len(text) > SUMMARY_CHARS_PER_TURN:
+        text = text[:SUMMARY_CHARS_PER_TURN].rsplit(' ', 1)[0] + '...'
+    return f"{turn['sender']}: {text}"
+
+
+class ConversationContextBuilder:
+    """
+    Turns a conversation history into a bounded prompt context.
+
+    The last recent_turns messages are kept verbatim (cleaned of HTML, quoted
+    replies and signatures) within token_budget tokens. Everything older is
+    passed through the summarize hook and folded into a summary entry placed
+    first; thread_summaries.ThreadContextLoader persists that summary and feeds
+    it only newly aged-out turns. The default hook, summarize_turn, truncates
+    each turn to its opening; pass a real summarizer to condense them
+    instead. Entries have the same [{"sender", "body"}] shape that
+    build_prompt / build_follow_up_prompt expect.
+    """
+
+    def __init__(self, recent_turns=RECENT_TURNS, token_budget=CONTEXT_TOKEN_BUDGET,
+                 summary_budget=SUMMARY_TOKEN_BUDGET, summarize=summarize_turn):
+        self.recent_turns = recent_turns
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.summarize = summarize
+
+    def select_recent(self, turns):
+        """Clean the newest turns and keep as many as fit in the token budget (at least one)."""
+        recent = []
+        used = 0
+        for turn in reversed(turns[-self.recent_turns:]):
+            body = clean_body(turn['body'])
+            tokens = count_tokens(body)
+            if recent and used + tokens > self.token_budget:
+                break
+            if tokens > self.token_budget:
+                body = truncate_tokens(body, self.token_budget)
+                tokens = self.token_budget
+            recent.append({"sender": turn['sender'], "body": body})
+            used += tokens
+        recent.reverse()
+        return recent
+
+    def trim_summary(self, summary):
+        # Newest parts matter most, so trim from the start when over budget
+        return truncate_tokens(summary, self.summary_budget, keep='tail')
+
+    def summary_entry(self, summary):
+        return {"sender": "summary", "body": f"Summary of earlier messages:\n{self.trim_summary(summary)}"}
@@ -0,0 +1,128 @@
+import os
+import re
+import sys
+
+# Follow-up instructions, edited in place while the agent runs
+FOLLOW_UP_PROMPT_PATH = os.getenv(
+    "FOLLOW_UP_PROMPT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "follow_up_prompt.txt")
+)
+# File for the base reply prompt; without it the path is taken from ai_handler (see below)
+BASE_PROMPT_PATH = os.getenv("BASE_PROMPT_PATH")
+# Constants in load_prompt_template()'s module naming the file it reads; when one is set the base
+# prompt is reloaded through load_prompt_template() whenever that file changes
+AI_HANDLER_PROMPT_PATH_NAMES = ("PROMPT_TEMPLATE_PATH", "PROMPT_PATH")
+
+# {field} placeholders; any other braces in a prompt are kept as literal text
+_PLACEHOLDER = re.compile(r'\{([A-Za-z_][A-Za-z0-9_]*)\}')
+
+
+class Template:
+    """
+    A prompt template split once into static text and {field} placeholders.
+
+    render() only joins the pre-split segments, so building a prompt does no
+    parsing. Placeholders without a value are left in the text unchanged.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        parts = _PLACEHOLDER.split(text)
+        # Even indexes are static text, odd indexes are field names
+        self.segments = [(i % 2 == 1, part) for i, part in enumerate(parts) if part]
+        self.fields = {part for is_field, part in self.segments if is_field}
+
+    def render(self, **values):
+        if not self.fields:
+            return self.text
+        return ''.join(
+            str(values[part]) if is_field and part in values else (f"{{{part}}}" if is_field else part)
+            for is_field, part in self.segments
+        )
+
+
+class TemplateRegistry:
+    """
+    Prompt templates kept in memory and reloaded only when their file changes.
+
+    Each get() costs one os.stat(). The template is loaded and split again
+    only when the file's mtime, inode or size differs from the last load, so
+    editing (or atomically replacing) a prompt file takes effect on the next
+    prompt without restarting the daemon. A template with both a path and a
+    loader is reloaded by calling the loader; with just a path the file itself
+    is read. If a reload fails, the last good version is kept. Templates
+    registered with just a loader are loaded once.
+    """
+
+    def __init__(self):
+        self._sources = {}
+        self._templates = {}
+        self._signatures = {}
+
+    def register(self, name, path=None, loader=None):
+        self._sources[name] = (path, loader)
+        self._templates.pop(name, None)
+        self._signatures.pop(name, None)
+
+    def get(self, name):
+        path, loader = self._sources[name]
+        if path is None:
+            if name not in self._templates:
+                self._templates[name] = Template(loader())
+            return self._templates[name]
+
+        try:
+            stat = os.stat(path)
+            signature = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+            if signature != self._signatures.get(name):
+                if loader is not None:
+                    text = loader()
+                else:
+                    with open(path, encoding='utf-8') as f:
+                        text = f.read().strip()
+                self._templates[name] = Template(text)
+                if name in self._signatures:
+                    print(f"Reloaded prompt template '{name}' from {path}")
+                self._signatures[name] = signature
+        except Exception as e:
+            if name not in self._templates:
+                raise
+            print(f"Could not reload prompt template '{name}' from {path}, keeping the loaded version: {e}")
+        return self._templates[name]
+
+    def render(self, name, **values):
+        return self.get(name).render(**values)
+
+
+def ai_handler_prompt_path(load_prompt_template):
+    """The file load_prompt_template() reads, from a constant in its module; None if none is set."""
+    module = sys.modules.get(getattr(load_prompt_template, '__module__', None))
+    for name in AI_HANDLER_PROMPT_PATH_NAMES:
+        path = getattr(module, name, None)
+        if path:
+            return os.fspath(path)
+    return None
+
+
+def default_registry(load_prompt_template):
+    """
+    Registry with the 'base' reply prompt and the 'follow_up' prompt.
+
+    Raises FileNotFoundError at startup if a configured prompt file is
+    missing. When the base prompt's file is known neither from
+    BASE_PROMPT_PATH nor from ai_handler, it is loaded once and a warning
+    says it will not be reloaded.
+    """
+    registry = TemplateRegistry()
+    if BASE_PROMPT_PATH:
+        base_path, base_loader = BASE_PROMPT_PATH, None
+    else:
+        base_path, base_loader = ai_handler_prompt_path(load_prompt_template), load_prompt_template
+        if base_path is None:
+            print("Warning: the base prompt will not hot-reload; set BASE_PROMPT_PATH to the prompt file "
+                  f"or define one of {', '.join(AI_HANDLER_PROMPT_PATH_NAMES)} in ai_handler")
+    for path in (base_path, FOLLOW_UP_PROMPT_PATH):
+        if path is not None and not os.path.isfile(path):
+            raise FileNotFoundError(f"Prompt template {path} does not exist")
+    registry.register('base', path=base_path, loader=base_loader)
+    registry.register('follow_up', path=FOLLOW_UP_PROMPT_PATH)
+    return registry
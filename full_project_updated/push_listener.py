@@ -0,0 +1,212 @@
+import asyncio
+import base64
+import binascii
+import json
+import os
+import time
+from urllib.parse import urlsplit, parse_qs
+
+# Port for the Pub/Sub push endpoint; unset keeps the agent on plain polling
+PUSH_PORT = os.getenv("GMAIL_PUSH_PORT")
+# Secret the push subscription's endpoint URL carries as ?token=..., so random POSTs are rejected
+PUSH_TOKEN = os.getenv("GMAIL_PUSH_TOKEN")
+# Without a token the endpoint only listens on loopback (e.g. behind a local reverse proxy)
+PUSH_HOST = os.getenv("GMAIL_PUSH_HOST") or ("0.0.0.0" if PUSH_TOKEN else "127.0.0.1")
+# Largest request body accepted; a Gmail notification envelope is a few hundred bytes
+PUSH_MAX_BODY_BYTES = int(os.getenv("GMAIL_PUSH_MAX_BODY_BYTES", str(64 * 1024)))
+# Most headers accepted in one request
+PUSH_MAX_HEADERS = 100
+# Seconds a client gets to send a whole request (also closes idle keep-alive connections)
+PUSH_READ_TIMEOUT_SECONDS = float(os.getenv("GMAIL_PUSH_READ_TIMEOUT_SECONDS", "10"))
+# Topic Gmail publishes mailbox changes to (projects/<project>/topics/<topic>)
+PUSH_TOPIC = os.getenv("GMAIL_PUSH_TOPIC")
+
+# Seconds between inbox checks without push
+POLL_INTERVAL_SECONDS = int(os.getenv("POLL_INTERVAL_SECONDS", "30"))
+# With push, the inbox is still checked this often in case a notification is lost
+PUSH_FALLBACK_POLL_SECONDS = int(os.getenv("PUSH_FALLBACK_POLL_SECONDS", "300"))
+# Gmail stops publishing 7 days after watch(); renew once a day
+WATCH_RENEW_SECONDS = 24 * 3600
+
+
+def decode_notification(body):
+    """{'emailAddress', 'historyId'} from a Pub/Sub push request body; ValueError if malformed."""
+    try:
+        envelope = json.loads(body)
+        data = base64.b64decode(envelope['message']['data'])
+        notification = json.loads(data)
+        return {'emailAddress': notification['emailAddress'], 'historyId': int(notification['historyId'])}
+    except (KeyError, TypeError, binascii.Error, json.JSONDecodeError) as e:
+        raise ValueError(f"Not a Gmail push notification: {e}")
+
+
+class PushListener:
+    """
+    HTTP endpoint for Gmail push notifications delivered by a Pub/Sub push subscription.
+
+    Every valid POST sets an asyncio.Event, and the main loop's wait() returns
+    as soon as it is set instead of sleeping out the poll interval. The
+    notification only says the mailbox changed, so the loop still runs its
+    usual history sync; several notifications arriving during one cycle
+    trigger a single extra sync. wait() gives up after timeout seconds, so
+    polling continues as a fallback if notifications stop arriving.
+
+    Requests are answered with 204 as soon as they are parsed (Pub/Sub
+    redelivers anything not acknowledged within its deadline), 400 for a body
+    that is not a Gmail notification, 403 for a wrong ?token= and 413 for a
+    body over max_body_bytes. A client that takes longer than read_timeout
+    seconds to send a request is disconnected. Without a token the listener
+    refuses to bind to anything but loopback.
+    """
+
+    def __init__(self, host=PUSH_HOST, port=0, token=PUSH_TOKEN, max_body_bytes=PUSH_MAX_BODY_BYTES,
+                 read_timeout=PUSH_READ_TIMEOUT_SECONDS):
+        if not token and host not in _LOOPBACK_HOSTS:
+            print(f"No GMAIL_PUSH_TOKEN set, binding the push listener to 127.0.0.1 instead of {host}")
+            host = "127.0.0.1"
+        self.host = host
+        self.port = port
+        self.token = token
+        self.max_body_bytes = max_body_bytes
+        self.read_timeout = read_timeout
+        self.received = 0
+        self.rejected = 0
+        self.last_history_id = None
+        self.last_received_at = None
+        self._event = asyncio.Event()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def wait(self, timeout):
+        """Wait for a notification. Returns False if timeout seconds passed without one."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._event.clear()
+        return True
+
+    def notify(self, notification):
+        self.received += 1
+        self.last_received_at = time.monotonic()
+        if self.last_history_id is None or notification['historyId'] > self.last_history_id:
+            self.last_history_id = notification['historyId']
+        self._event.set()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.read_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+
+                # The unread body of an oversized request leaves the connection unusable
+                status = 413 if body is None else self._respond(method, target, body)
+                writer.write(f"HTTP/1.1 {status} {_REASONS[status]}\r\nContent-Length: 0\r\n\r\n".encode('latin-1'))
+                await writer.drain()
+                if status == 413 or headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        """(method, target, headers, body) of the next request, None at EOF; body is None when too large."""
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        for _ in range(PUSH_MAX_HEADERS + 1):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise ValueError("too many headers")
+        length = int(headers.get('content-length', '0'))
+        if length < 0:
+            raise ValueError(f"bad Content-Length {length}")
+        if length > self.max_body_bytes:
+            self.rejected += 1
+            return method, target, headers, None
+        return method, target, headers, await reader.readexactly(length)
+
+    def _respond(self, method, target, body):
+        if method != 'POST':
+            return 405
+        if self.token and parse_qs(urlsplit(target).query).get('token', [None])[0] != self.token:
+            self.rejected += 1
+            return 403
+        try:
+            notification = decode_notification(body)
+        except ValueError as e:
+            self.rejected += 1
+            print(f"Push listener: {e}")
+            return 400
+        self.notify(notification)
+        return 204
+
+
+_REASONS = {204: 'No Content', 400: 'Bad Request', 403: 'Forbidden', 405: 'Method Not Allowed',
+            413: 'Payload Too Large'}
+_LOOPBACK_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+
+class GmailWatch:
+    """
+    Keeps Gmail publishing changes to the mailbox's INBOX label to a Pub/Sub topic.
+
+    users.watch() lasts 7 days, so renew_if_due() is called every cycle and
+    re-registers once a day. Failures are logged and retried next cycle; the
+    agent keeps polling meanwhile.
+    """
+
+    def __init__(self, gmail_client, topic, label_ids=('INBOX',)):
+        self.gmail_client = gmail_client
+        self.topic = topic
+        self.label_ids = list(label_ids)
+        self.expiration = None
+        self._renewed_at = None
+
+    def renew_if_due(self):
+        if self._renewed_at is not None and time.time() - self._renewed_at < WATCH_RENEW_SECONDS:
+            return
+        try:
+            response = self.gmail_client.service.users().watch(userId='me', body={
+                'topicName': self.topic,
+                'labelIds': self.label_ids,
+                'labelFilterBehavior': 'include',
+            }).execute()
+        except Exception as e:
+            print(f"Could not register Gmail push notifications on {self.topic}: {e}")
+            return
+        self._renewed_at = time.time()
+        self.expiration = int(response.get('expiration', 0)) // 1000 or None
+        print(f"Gmail push notifications registered on {self.topic} (history {response.get('historyId')})")
@@ -0,0 +1,82 @@
+import html
+import re
+
+# Every pattern below starts with a literal character. The regex engine finds
+# a literal prefix with a fast substring search, while a pattern that can
+# start with one of several characters (or a MULTILINE ^) is tried at every
+# position, which made a single combined tokenizer slower than the old
+# chain of re.sub calls.
+
+# "Subject:" lines the model sometimes puts at the top of a reply, matched
+# together with the line break before them
+_SUBJECT_LINE = re.compile(r'\n[ \t]*subject:[^\n]*', re.IGNORECASE)
+
+# A block of "-" / "*" / "1." lines, with the line breaks around it. The
+# lookahead rejects ordinary lines before the repeated group is entered.
+_LIST_BLOCK = re.compile(
+    r'\n(?=[ \t]*(?:[-*•]|\d+[.)])[ \t])((?:[ \t]*(?:[-*•]|\d+[.)])[ \t]+[^\n]*(?:\n|\Z))+)'
+)
+_LIST_ITEM = re.compile(r'[ \t]*(?:[-*•]|(?P<number>\d+)[.)])[ \t]+(?P<item>.*)')
+_LINK = re.compile(r'\[([^\]\n]+)\]\(((?:https?://|mailto:)[^)\s]+)\)')
+_BOLD = re.compile(r'\*\*(.+?)\*\*')
+_ITALIC = re.compile(r'\*(.+?)\*')
+
+
+def _render_list(match):
+    items = []
+    tag = None
+    for line in match.group(1).splitlines():
+        item = _LIST_ITEM.match(line)
+        item_tag = 'ol' if item.group('number') else 'ul'
+        if item_tag != tag:
+            if tag:
+                items.append(f"</{tag}>")
+            items.append(f"<{item_tag}>")
+            tag = item_tag
+        items.append(f"<li>{item.group('item')}</li>")
+    items.append(f"</{tag}>")
+    return ''.join(items)
+
+
+def _render_bold(match):
+    return f"<strong>{match.group(1)}</strong>"
+
+
+def _render_italic(match):
+    return f"<em>{match.group(1)}</em>"
+
+
+def _render_link(match):
+    # An entity keeps a '*' in the URL away from the bold/italic passes
+    url = match.group(2).replace('*', '&#42;')
+    return f'<a href="{url}">{match.group(1)}</a>'
+
+
+def strip_subject_lines(text):
+    """Drop "Subject:" lines and trim surrounding whitespace."""
+    return _SUBJECT_LINE.sub('', '\n' + text).strip()
+
+
+def render_html(text, strip_subject=True):
+    """
+    Convert a markdown-like LLM reply into email HTML.
+
+    Supports **bold**, *italic*, [links](https://...) and "-" / "1." lists.
+    Other line breaks become <br>, so blank-line separated paragraphs render
+    as <br><br> exactly as before. With strip_subject, "Subject:" lines are
+    dropped and surrounding whitespace is trimmed.
+    """
+    if strip_subject:
+        text = strip_subject_lines(text)
+    # A leading newline lets a list on the first line match like any other
+    text = '\n' + html.escape(text)
+    text = _LIST_BLOCK.sub(_render_list, text)
+    if '](' in text:
+        text = _LINK.sub(_render_link, text)
+    if '*' in text:
+        text = _BOLD.sub(_render_bold, text)
+        text = _ITALIC.sub(_render_italic, text)
+    if text.startswith('\n'):
+        text = text[1:]
+    # Remaining line breaks are plain text breaks; list blocks consumed their own
+    return text.replace('\n', '<br>')
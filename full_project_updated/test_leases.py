@@ -0,0 +1,73 @@
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from agent_state import metadata, leases
+from leases import LeaseManager
+
+
+class Interleaved:
+    """The heartbeat's session, running main-loop steps between the renewal's statements."""
+
+    def __init__(self, session, after_commit, after_select):
+        self.session = session
+        self.after_commit = after_commit
+        self.after_select = after_select
+
+    def execute(self, statement):
+        if not statement.is_select:
+            return self.session.execute(statement)
+        frozen = self.session.execute(statement).freeze()
+        self.after_select()
+        return frozen()
+
+    def commit(self):
+        self.session.commit()
+        self.after_commit()
+
+
+def lease_manager():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    return LeaseManager(Session(), owner="worker-1"), Session()
+
+
+def test_released_during_renewal_is_not_lost():
+    manager, heartbeat_session = lease_manager()
+    manager.acquire_many({"lead:a@example.com", "lead:b@example.com"})
+
+    # The main loop releases a lead after the renewal's update and takes it again
+    # before the renewal compares what it still holds
+    renewal = Interleaved(
+        heartbeat_session,
+        after_commit=lambda: manager.release({"lead:a@example.com"}),
+        after_select=lambda: manager.acquire("lead:a@example.com"),
+    )
+    manager.renew(renewal)
+
+    # a@ is held again and must keep being renewed and released
+    assert manager.held == {"lead:a@example.com", "lead:b@example.com"}
+
+
+def test_taken_over_lease_is_dropped():
+    manager, heartbeat_session = lease_manager()
+    manager.acquire_many({"lead:a@example.com", "lead:b@example.com"})
+
+    # Another worker took over a@ after the lease expired
+    heartbeat_session.execute(
+        update(leases).where(leases.c.resource == "lead:a@example.com").values(owner="worker-2")
+    )
+    heartbeat_session.commit()
+
+    manager.renew(heartbeat_session)
+    assert manager.held == {"lead:b@example.com"}
+
+
+def main():
+    test_released_during_renewal_is_not_lost()
+    test_taken_over_lease_is_dropped()
+    print("Leases OK")
+
+
+if __name__ == "__main__":
+    main()
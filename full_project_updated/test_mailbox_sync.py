@@ -0,0 +1,103 @@
+import pytest
+
+pytest.importorskip("googleapiclient")
+
+import httplib2
+from googleapiclient.errors import HttpError
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from agent_state import metadata, get_cursor
+from fake_gmail import FakeGmailClient
+from mailbox_sync import MailboxSync
+
+
+def inbox_sync():
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    client = FakeGmailClient()
+    sync = MailboxSync(client, session, cursor_name='inbox', label_id='INBOX', resync_query="is:unread",
+                       required_labels=('INBOX', 'UNREAD'))
+    return client, session, sync
+
+
+def ids(stubs):
+    return [stub['id'] for stub in stubs]
+
+
+def test_cursor_moves_only_on_commit():
+    client, session, sync = inbox_sync()
+    first = client.add_message("jane@example.com", client.address, "Hi", "Question")
+
+    # No cursor yet: full listing, then the cursor starts at the current history ID
+    assert ids(sync.poll()) == [first]
+    assert get_cursor(session, 'inbox') is None
+    sync.commit()
+    assert get_cursor(session, 'inbox') == str(client.history_id)
+
+    second = client.add_message("bob@example.com", client.address, "Hello", "Another question")
+    assert ids(sync.poll()) == [second]
+    # Not committed: the same changes come back
+    assert ids(sync.poll()) == [second]
+    sync.commit()
+    assert sync.poll() == []
+
+
+def test_expired_history_falls_back_to_a_resync():
+    client, session, sync = inbox_sync()
+    sync.poll()
+    sync.commit()
+
+    unread = client.add_message("jane@example.com", client.address, "Hi", "Question")
+    client.expire_history()
+    assert ids(sync.poll()) == [unread]
+    sync.commit()
+    assert get_cursor(session, 'inbox') == str(client.history_id)
+    # Handled messages are marked read, so they are not listed again
+    client.mark_as_read(unread)
+    assert sync.poll() == []
+
+
+def test_gmail_errors_skip_the_cycle_without_moving_the_cursor(monkeypatch):
+    client, session, sync = inbox_sync()
+    sync.poll()
+    sync.commit()
+    cursor = get_cursor(session, 'inbox')
+    added = client.add_message("jane@example.com", client.address, "Hi", "Question")
+
+    calls = []
+
+    def unavailable():
+        calls.append(1)
+        raise HttpError(httplib2.Response({'status': 503}), b'{"error": {"code": 503, "message": "Backend Error"}}')
+
+    monkeypatch.setattr(client, '_round_trip', unavailable)
+    assert sync.poll() == []
+    sync.commit()
+    assert get_cursor(session, 'inbox') == cursor
+    # Retries are left to the transport: one call, then the cycle is skipped
+    assert len(calls) == 1
+
+    monkeypatch.undo()
+    assert ids(sync.poll()) == [added]
+
+
+def test_other_gmail_errors_are_raised(monkeypatch):
+    client, session, sync = inbox_sync()
+
+    def forbidden():
+        raise HttpError(httplib2.Response({'status': 403}), b'{"error": {"code": 403, "message": "Forbidden"}}')
+
+    monkeypatch.setattr(client, '_round_trip', forbidden)
+    with pytest.raises(HttpError):
+        sync.poll()
+
+
+def main():
+    test_cursor_moves_only_on_commit()
+    test_expired_history_falls_back_to_a_resync()
+    print("Mailbox sync OK")
+
+
+if __name__ == "__main__":
+    main()
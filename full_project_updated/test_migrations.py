@@ -0,0 +1,64 @@
+from datetime import datetime
+import pytest
+
+# The lead/conversation schema comes from the application's database package
+pytest.importorskip("database.models")
+pytest.importorskip("database.db_handler")
+
+from sqlalchemy import create_engine, insert, select, func, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database.models import Conversation, Lead
+from migrations import run_migrations, query_plans
+
+
+def legacy_session():
+    # A database created by init_db() before any migration, with the duplicates older versions could write
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Lead.metadata.create_all(engine)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(Lead.__table__), [
+            {'id': 1, 'email': "jane@example.com", 'status': 'Initial'},
+            {'id': 2, 'email': "jane@example.com", 'status': 'Initial'},
+            {'id': 3, 'email': "bob@example.com", 'status': 'Initial'},
+        ])
+        conn.execute(insert(Conversation.__table__), [
+            {'lead_id': 1, 'thread_id': "t1", 'message_id': "<m1@x>", 'sender': "jane@example.com",
+             'body': "Hi", 'timestamp': now},
+            {'lead_id': 2, 'thread_id': "t1", 'message_id': "<m1@x>", 'sender': "jane@example.com",
+             'body': "Hi", 'timestamp': now},
+            {'lead_id': 3, 'thread_id': "t2", 'message_id': "<m2@x>", 'sender': "bob@example.com",
+             'body': "Hello", 'timestamp': now},
+        ])
+    return sessionmaker(bind=engine)()
+
+
+def test_migrations_merge_duplicates():
+    session = legacy_session()
+    run_migrations(session)
+    assert session.execute(select(func.count()).select_from(Conversation.__table__)).scalar() == 2
+    # The removed copy is kept aside
+    assert session.execute(text("SELECT lead_id, message_id FROM conversation_duplicates")).all() == [(2, "<m1@x>")]
+    assert session.execute(select(func.count()).select_from(Lead.__table__)).scalar() == 2
+    indexes = set(session.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+    assert {"uq_conversations_message_id", "uq_leads_email", "uq_leads_email_canonical"} <= indexes
+
+
+def test_hot_queries_use_indexes():
+    session = legacy_session()
+    run_migrations(session)
+    for label, plan in query_plans(session).items():
+        # SQLite reports a full table scan as "SCAN <table>" and an index lookup as "SEARCH ... USING ... INDEX"
+        assert not any(line.startswith("SCAN") for line in plan), f"{label}: {plan}"
+        assert any("INDEX" in line for line in plan), f"{label}: {plan}"
+
+
+def main():
+    test_migrations_merge_duplicates()
+    test_hot_queries_use_indexes()
+    print("Migrations OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import asyncio
+import re
+import pytest
+
+pytest.importorskip("database.models")
+pytest.importorskip("ai_handler")
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database.models import Lead
+from fake_gmail import FakeGmailClient
+from generation_settings import GenerationSettings
+from migrations import run_migrations
+from outbox import Outbox, reply_key, sent_message_id, REPLY, RECORDED
+
+AGENT = "Build Your Socials <executive@buildyoursocials.com>"
+
+
+class AcceptedThenTimedOut(FakeGmailClient):
+    """Gmail takes the message, but the response is lost (e.g. a read timeout)."""
+
+    def send_message(self, message):
+        super().send_message(message)
+        raise TimeoutError("The read operation timed out")
+
+
+class FixedGeneration:
+    async def generate(self, prompt, settings):
+        return None, "Thanks for asking!"
+
+    def discard(self, key):
+        pass
+
+
+class NoHistory:
+    def for_lead(self, lead_id):
+        return []
+
+
+class FixedTemplates:
+    def render(self, name, **values):
+        return "You are a helpful sales assistant."
+
+
+def send_with_lost_response():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Lead.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    run_migrations(session)
+    session.execute(insert(Lead.__table__).values(id=1, email="jane@example.com", status='Initial'))
+    session.commit()
+
+    gmail = AcceptedThenTimedOut(address="executive@buildyoursocials.com")
+    outbox = Outbox(session, gmail, NoHistory(), FixedTemplates(), FixedGeneration(), GenerationSettings())
+    key = reply_key("<q1@example.com>")
+    outbox.enqueue(key, REPLY, 1, "t1", "jane@example.com", parent_message_id="<q1@example.com>",
+                   sender=AGENT, subject="Pricing")
+    state = asyncio.run(outbox.deliver(key))
+    return outbox.get(key), state, gmail
+
+
+def test_message_id_uses_the_bare_sender_address():
+    entry, _, _ = send_with_lost_response()
+    assert re.fullmatch(r"<[^<>@\s]+@buildyoursocials\.com>", sent_message_id(entry)), sent_message_id(entry)
+
+
+def test_lost_send_response_is_not_sent_again():
+    entry, state, gmail = send_with_lost_response()
+    # The sent copy is found by its Message-ID, so the entry is recorded instead of retried
+    assert state == RECORDED
+    assert entry.attempts == 0
+    assert len(gmail.sent) == 1
+
+
+def main():
+    test_message_id_uses_the_bare_sender_address()
+    test_lost_send_response_is_not_sent_again()
+    print("Outbox OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import random
+import re
+from bench_rendering import legacy_render
+from rendering import render_html
+
+# Inputs whose output must stay identical to the old nested markdown_to_html
+GOLDEN_CASES = [
+    ("Hello there", "Hello there"),
+    ("Hi **John**,\nThanks for *reaching out*.", "Hi <strong>John</strong>,<br>Thanks for <em>reaching out</em>."),
+    ("Line one\n\nLine two", "Line one<br><br>Line two"),
+    ("**Bold with *italic* inside**", "<strong>Bold with <em>italic</em> inside</strong>"),
+    ("Price < 5 & \"quoted\"", "Price &lt; 5 &amp; &quot;quoted&quot;"),
+    ("Subject: Follow up\n\nHi Jane,\nBest,\nAgent", "Hi Jane,<br>Best,<br>Agent"),
+    ("  \nHi *there*  \n", "Hi <em>there</em>"),
+    # Found by fuzzing a single-pass tokenizer, which paired the markers differently
+    ("*x***b**", "<em>x<strong></em>b</strong>"),
+]
+
+# Lists and links, which the old renderer left as plain text
+FORMATTED_CASES = [
+    ("Options:\n- Content planning\n- Weekly reporting\nBest",
+     "Options:<ul><li>Content planning</li><li>Weekly reporting</li></ul>Best"),
+    ("1. Call\n2. Plan", "<ol><li>Call</li><li>Plan</li></ol>"),
+    ("Book [a call](https://example.com/a*b*c)", 'Book <a href="https://example.com/a&#42;b&#42;c">a call</a>'),
+]
+
+
+def test_golden_cases_match_the_previous_renderer():
+    for source, expected in GOLDEN_CASES:
+        assert legacy_render(source) == expected, source
+        assert render_html(source) == expected, source
+
+
+def test_lists_and_links():
+    for source, expected in FORMATTED_CASES:
+        assert render_html(source) == expected, source
+
+
+# A line starting with "* " is a list item, which the old renderer did not know
+_LIST_LINE = re.compile(r'^[ \t]*\*[ \t]', re.MULTILINE)
+
+
+def test_random_emphasis_matches_the_previous_renderer():
+    # Without list or link syntax the output must not change at all
+    rng = random.Random(0)
+    for _ in range(5000):
+        source = ''.join(rng.choice("*xb \n<&") for _ in range(rng.randint(0, 12)))
+        if _LIST_LINE.search(source):
+            continue
+        assert render_html(source) == legacy_render(source), repr(source)
+
+
+def main():
+    test_golden_cases_match_the_previous_renderer()
+    test_lists_and_links()
+    test_random_emphasis_matches_the_previous_renderer()
+    print("Rendering OK")
+
+
+if __name__ == "__main__":
+    main()
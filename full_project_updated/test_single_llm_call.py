@@ -0,0 +1,87 @@
+import asyncio
+from unittest import mock
+import pytest
+
+# The lead/conversation schema and the prompt helpers come from the application packages
+pytest.importorskip("database.models")
+pytest.importorskip("database.db_handler")
+pytest.importorskip("ai_handler")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database.models import Lead
+from fake_gmail import FakeGmailClient
+from generation_cache import GenerationCache
+from generation_settings import GenerationSettings
+from inbound_pipeline import InboundPipeline
+from leases import LeaseManager
+from message_dedup import ProcessedMessageIndex
+from migrations import run_migrations
+from outbox import Outbox
+from prompt_context import ConversationContextBuilder
+from thread_summaries import ThreadContextLoader
+
+AGENT_EMAIL = "agent@buildyoursocials.com"
+
+
+class FixedTemplates:
+    def render(self, name, **values):
+        return "You are a helpful sales assistant."
+
+
+async def answer_inbox(llm):
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Lead.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    run_migrations(session)
+
+    gmail = FakeGmailClient(address=AGENT_EMAIL)
+    msg_id = gmail.add_message('"Jane Doe" <jane@example.com>', AGENT_EMAIL, "Pricing", "How much is the package?")
+    leases = LeaseManager(session)
+    outbox = Outbox(session, gmail, ThreadContextLoader(session, ConversationContextBuilder()), FixedTemplates(),
+                    GenerationCache(session), GenerationSettings(), leases=leases)
+    pipeline = InboundPipeline(session, gmail, ProcessedMessageIndex(session), outbox, leases)
+    with mock.patch("generation_cache.generate_reply_async", llm):
+        await pipeline.run_cycle([msg_id])
+        # The same message showing up again (e.g. a resync) must not be answered twice
+        await pipeline.run_cycle([msg_id])
+    return gmail
+
+
+def test_one_llm_call_per_inbound_reply():
+    llm = mock.AsyncMock(return_value="Thanks for asking! Our packages start at $500 a month.")
+    gmail = asyncio.run(answer_inbox(llm))
+    assert llm.await_count == 1, f"LLM called {llm.await_count} times"
+    assert llm.await_args.kwargs == {'max_tokens': 900}
+    assert len(gmail.sent) == 1
+
+
+def test_settings_only_pass_what_the_client_takes():
+    def generate_reply(prompt, max_tokens=500):
+        pass
+
+    settings = GenerationSettings(model="gpt-4o", timeout=30.0)
+    assert settings.as_kwargs() == {'model': "gpt-4o", 'max_tokens': 900, 'timeout': 30.0}
+    assert settings.as_kwargs(generate_reply) == {'max_tokens': 900}
+
+
+def test_settings_require_a_model():
+    assert GenerationSettings(model="gpt-4o").require_model().model == "gpt-4o"
+    try:
+        GenerationSettings().require_model()
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("a missing model must stop the agent at startup")
+
+
+def main():
+    test_one_llm_call_per_inbound_reply()
+    test_settings_only_pass_what_the_client_takes()
+    test_settings_require_a_model()
+    print("Single LLM call OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from sqlalchemy import func
+from sqlalchemy.orm import defer
+from database.models import Conversation
+from agent_state import get_thread_summary, save_thread_summary
+from prompt_context import truncate_tokens
+from body_store import load_bodies
+
+# Stored summaries are capped at this multiple of the prompt summary budget
+STORED_SUMMARY_FACTOR = 4
+
+
+class ThreadContextLoader:
+    """
+    Builds prompt context from the database without reading the whole history.
+
+    Only the newest builder.recent_turns conversation rows are loaded
+    verbatim. Older messages live in a rolling summary persisted in the
+    thread_summaries table; by default it holds truncated excerpts of each
+    message (see prompt_context.summarize_turn). Each call summarizes just
+    the rows that have aged out of the recent window since the last update,
+    so prompt size and per-message work stay flat however long the thread
+    gets. Bodies are read from conversation_bodies for the loaded rows only.
+    """
+
+    def __init__(self, session, builder):
+        self.session = session
+        self.builder = builder
+
+    def for_thread(self, thread_id):
+        return self.history(f"thread:{thread_id}", Conversation.thread_id == thread_id)
+
+    def for_lead(self, lead_id):
+        return self.history(f"lead:{lead_id}", Conversation.lead_id == lead_id)
+
+    def history(self, context_key, criterion):
+        session = self.session
+        total = session.query(func.count(Conversation.id)).filter(criterion).scalar() or 0
+        newest = session.query(Conversation).options(defer(Conversation.body)).filter(criterion).order_by(
+            Conversation.timestamp.desc()
+        ).limit(self.builder.recent_turns).all()
+        bodies = load_bodies(session, newest)
+        turns = [_turn(conv, bodies) for conv in reversed(newest)]
+        recent = self.builder.select_recent(turns)
+        # Loaded rows that did not fit the token budget are summarized for this call only
+        over_budget = [self.builder.summarize(turn) for turn in turns[:len(turns) - len(recent)]]
+
+        # Counted from the loaded rows, not the budget-trimmed ones, so the persisted
+        # window only moves when messages arrive
+        older_count = total - len(newest)
+        if older_count <= 0:
+            if over_budget:
+                return [self.builder.summary_entry('\n'.join(over_budget))] + recent
+            return recent
+
+        stored = get_thread_summary(session, context_key)
+        summary, summarized = stored if stored else ("", 0)
+        if summarized > older_count:
+            # History shrank (e.g. rows deleted): start the summary again
+            summary, summarized = "", 0
+
+        if summarized < older_count:
+            aged_out = session.query(Conversation).options(defer(Conversation.body)).filter(criterion).order_by(
+                Conversation.timestamp.asc()
+            ).offset(summarized).limit(older_count - summarized).all()
+            bodies = load_bodies(session, aged_out)
+            parts = [summary] if summary else []
+            parts.extend(self.builder.summarize(_turn(conv, bodies)) for conv in aged_out)
+            summary = truncate_tokens(
+                '\n'.join(parts), self.builder.summary_budget * STORED_SUMMARY_FACTOR, keep='tail'
+            )
+            save_thread_summary(session, context_key, summary, older_count)
+
+        return [self.builder.summary_entry('\n'.join([summary] + over_budget))] + recent
+
+
+def _turn(conv, bodies):
+    return {"id": conv.id, "sender": conv.sender, "body": bodies[conv.id]}